@@ -11,39 +11,88 @@
 
 import os
 import sys
-import traceback
+import asyncio
+import logging
+from itertools import cycle, islice
 from pathlib import Path
 from datetime import datetime
 
 # 添加项目根目录到 Python 路径，确保可以正确导入模块
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# 添加详细的调试输出
-def debug_print(message):
-    """调试打印函数"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] DEBUG: {message}")
+# 调试输出：未开启 DEBUG 级别时不会格式化参数
+logger = logging.getLogger(__name__)
 
 # 导入模块时添加错误处理
 try:
-    from utils.audio_processor import AudioProcessor
-    debug_print("成功导入 AudioProcessor")
-except Exception as e:
-    print(f"警告：导入 AudioProcessor 失败: {e}")
-    print(traceback.format_exc())
+    from utils.audio_processor import create_audio_processor, split_sentence_tail
+    logger.debug("成功导入 create_audio_processor")
+except Exception:
+    logger.exception("警告：导入 AudioProcessor 失败")
     raise
 
 try:
-    from utils.image_generator import create_images_for_sentences, generate_image
-    debug_print("成功导入 image_generator 函数")
-except Exception as e:
-    print(f"警告：导入 image_generator 函数失败: {e}")
-    print(traceback.format_exc())
+    from utils.image_generator import (build_prompt, close_async_clients, generate_image_async,
+                                       generate_images_batch_async)
+    logger.debug("成功导入 image_generator 函数")
+except Exception:
+    logger.exception("警告：导入 image_generator 函数失败")
     raise
 
-def audio_to_images_pipeline(audio_path, style="艺术风格", max_images=8, extract_keywords=True):
+from config import IMAGE_CONFIG, OUTPUT_IMAGES, OUTPUT_TRANSCRIBED, OUTPUT_TRANSCRIBED_PATH, ensure_dir
+
+# 转录或生成失败时使用的默认关键词
+DEFAULT_KEYWORDS = ["音乐", "艺术", "自然", "风景", "创意"]
+
+async def _transcribe_and_generate(processor, audio_path, style, max_images, extract_keywords, semaphore):
     """
-    音频转图片的完整流程
+    边转录边生成图片：转录线程逐段产出文本，每得到一个有效句子就立即提交图片生成任务
+    
+    返回:
+        (转录文本, 句子列表, 关键词列表, 图片生成任务列表)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    
+    def produce():
+        try:
+            for text, _start, _end in processor.transcribe_stream(audio_path):
+                loop.call_soon_threadsafe(queue.put_nowait, text)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+    
+    segments, sentences, keywords, tasks = [], [], [], []
+    
+    def submit(text):
+        for sentence in processor.split_into_sentences(text):
+            sentences.append(sentence)
+            # 跳过太短的句子，关键词数量达到上限后只继续收集句子
+            if len(sentence) < 5 or len(keywords) >= max_images:
+                continue
+            # 简单处理：取句子前10个字符作为关键词，空关键词使用"音乐"
+            keyword = (sentence[:10].strip() or "音乐") if extract_keywords else sentence
+            keywords.append(keyword)
+            tasks.append(asyncio.create_task(
+                generate_image_async(build_prompt(keyword, style), semaphore)
+            ))
+    
+    async def consume():
+        # 片段末尾未结束的半句留到下一段拼接后再分句，转录结束时一并处理
+        tail = ""
+        while (text := await queue.get()) is not None:
+            segments.append(text)
+            complete, tail = split_sentence_tail(tail + text)
+            if complete:
+                submit(complete)
+        if tail.strip():
+            submit(tail)
+    
+    await asyncio.gather(asyncio.to_thread(produce), consume())
+    return "".join(segments).strip(), sentences, keywords, tasks
+
+async def audio_to_images_pipeline_async(audio_path, style="艺术风格", max_images=8, extract_keywords=True):
+    """
+    音频转图片的完整流程（异步版本），转录与图片生成重叠执行
     
     参数:
         audio_path: 音频文件路径
@@ -58,123 +107,100 @@ def audio_to_images_pipeline(audio_path, style="艺术风格", max_images=8, ext
         print(f"\n{'='*50}")
         print(f"开始音频到图片的处理流程...")
         
-        # 检查音频文件是否存在
-        if not os.path.exists(audio_path):
+        # 检查音频文件是否存在（只 stat 一次，后续复用）
+        audio_file = Path(audio_path)
+        try:
+            audio_stat = audio_file.stat()
+        except FileNotFoundError:
             raise FileNotFoundError(f"音频文件不存在: {audio_path}")
         print(f"音频文件: {audio_path}")
-        debug_print(f"音频文件大小: {os.path.getsize(audio_path) / 1024:.2f} KB")
+        logger.debug("音频文件大小: %.2f KB", audio_stat.st_size / 1024)
         
-        # 1. 初始化音频处理器并转录音频
+        # 1. 初始化音频处理器
         print("初始化音频处理器...")
-        processor = AudioProcessor("base")  # 可以根据需要使用更大的模型如 "small" 或 "medium"
+        processor = create_audio_processor()  # 模型大小、后端与精度见 config.WHISPER_CONFIG
+        semaphore = asyncio.Semaphore(IMAGE_CONFIG.get("max_concurrency", 4))
         
-        # 2. 转录音频
-        print("开始转录音频...")
-        transcript = processor.transcribe_audio(audio_path)
+        # 2. 流式转录音频，同时为已得到的句子生成图片
+        print("开始转录音频（同时生成图片）...")
+        transcript, sentences, keywords, tasks = await _transcribe_and_generate(
+            processor, audio_path, style, max_images, extract_keywords, semaphore
+        )
         
         # 检查转录结果
-        if not transcript or not transcript.strip():
-            print("警告：转录结果为空或只有空白字符")
-            # 添加默认关键词作为备用
-            default_keywords = ["音乐", "艺术", "自然", "风景", "创意"]
-            print(f"使用默认关键词: {default_keywords}")
-            return generate_default_images(default_keywords, style, max_images)
+        if not transcript:
+            return await _fallback_to_default_images("警告：转录结果为空或只有空白字符", style, max_images)
         
         print(f"转录文本长度: {len(transcript)} 字符")
         print(f"转录文本: {transcript[:150]}...")
+        print(f"分割得到 {len(sentences)} 个句子")
         
-        # 3. 分割句子
-        print("分割句子...")
-        try:
-            _lang = 'english' if any(ch.isascii() and ch.isalpha() for ch in transcript) else 'chinese'
-            sentences = processor.split_into_sentences(transcript, language=_lang)
-            print(f"分割得到 {len(sentences)} 个句子")
-            
-            # 检查句子分割结果
-            if not sentences:
-                print("警告：句子分割结果为空")
-                # 添加默认句子作为备用
-                sentences = [transcript[:50]] if len(transcript) > 50 else [transcript]
-                print(f"使用简化句子: {sentences}")
-            
-            # 打印所有句子
-            for i, sent in enumerate(sentences, 1):
-                print(f"句子 {i}: '{sent}'")
-        except Exception as e:
-            print(f"警告：句子分割失败: {e}")
-            # 使用默认关键词作为备用
+        # 3. 检查句子分割结果
+        if not sentences:
+            print("警告：句子分割结果为空")
+            # 添加默认句子作为备用
             sentences = [transcript[:50]] if len(transcript) > 50 else [transcript]
             print(f"使用简化句子: {sentences}")
         
-        # 4. 提取关键词或使用完整句子
+        # 打印所有句子
+        for i, sent in enumerate(sentences, 1):
+            print(f"句子 {i}: '{sent}'")
+        
+        # 4. 关键词已在转录过程中提取
         print("处理文本内容...")
         try:
-            keywords = []
             if extract_keywords:
-                print("提取关键词...")
-                for sentence in sentences:
-                    # 检查句子长度
-                    if len(sentence) < 5:
-                        print(f"跳过太短的句子: {sentence}")
-                        continue
-                    
-                    # 简单处理：取句子前10个字符作为关键词
-                    keyword = sentence[:10].strip()
-                    # 确保关键词不为空
-                    if not keyword:
-                        keyword = "音乐"
-                    keywords.append(keyword)
-                    print(f"关键词: '{keyword}'")
+                log_lines = [f"跳过太短的句子: {s}" for s in sentences if len(s) < 5]
+                log_lines.extend(f"关键词: '{keyword}'" for keyword in keywords)
+                if log_lines:
+                    print("\n".join(log_lines))
             else:
-                # 过滤短句子
-                keywords = [s for s in sentences if len(s) >= 5]
                 print(f"使用完整句子作为关键词，共 {len(keywords)} 个")
             
-            # 限制关键词数量并填充
-            keywords = keywords[:max_images]
-            if len(keywords) < max_images:
-                _fill = ["音乐","艺术","自然","风景","创意"]
-                i = 0
-                while len(keywords) < max_images:
-                    keywords.append(_fill[i % len(_fill)])
-                    i += 1
+            # 关键词不足时填充，并为填充的关键词补充生成任务
+            pad = list(islice(cycle(DEFAULT_KEYWORDS), max(0, max_images - len(keywords))))
+            keywords.extend(pad)
+            # 填充的关键词一次性批量提交，与句子配图共用并发上限
+            pad_task = asyncio.create_task(
+                generate_images_batch_async(pad, style, semaphore=semaphore)
+            ) if pad else None
             
-            # 5. 保存转录结果和关键词
+            # 5. 保存转录结果和关键词（图片在后台继续生成）
             print("保存转录结果和关键词...")
-            output_dir = Path("output/transcribed")
-            output_dir.mkdir(parents=True, exist_ok=True)
+            ensure_dir(OUTPUT_TRANSCRIBED)
+            output_dir = OUTPUT_TRANSCRIBED_PATH
             
             # 生成时间戳
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            audio_name = os.path.splitext(os.path.basename(audio_path))[0]
+            audio_name = audio_file.stem
             
             # 保存转录文本
             transcript_file = output_dir / f"{audio_name}_{timestamp}_transcript.txt"
-            with open(transcript_file, "w", encoding="utf-8") as f:
-                f.write(transcript)
+            transcript_file.write_text(transcript, encoding="utf-8")
             print(f"转录结果已保存到: {transcript_file}")
             
-            # 保存句子和关键词
+            # 保存句子和关键词：先在内存中拼接，再一次性写入
             keywords_file = output_dir / f"{audio_name}_{timestamp}_keywords.txt"
-            with open(keywords_file, "w", encoding="utf-8") as f:
-                for i, (sentence, keyword) in enumerate(zip(sentences[:len(keywords)], keywords), 1):
-                    f.write(f"句子 {i}: {sentence}\n")
-                    f.write(f"关键词 {i}: {keyword}\n\n")
+            keywords_text = "".join(
+                f"句子 {i}: {sentence}\n关键词 {i}: {keyword}\n\n"
+                for i, (sentence, keyword) in enumerate(zip(sentences, keywords), 1)
+            )
+            keywords_file.write_text(keywords_text, encoding="utf-8")
             print(f"关键词已保存到: {keywords_file}")
             
-            # 6. 生成图片
-            print(f"开始生成图片，风格: {style}，最大数量: {max_images}")
-            debug_print(f"使用的关键词列表: {keywords[:max_images]}")
+            # 6. 等待所有图片生成完成
+            print(f"等待图片生成完成，风格: {style}，最大数量: {max_images}")
+            logger.debug("使用的关键词列表: %s", keywords)
             
-            # 使用批量生成图片函数
-            image_paths = create_images_for_sentences(keywords[:max_images], style, max_images)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            image_paths = [path for path in results if path and not isinstance(path, Exception)]
+            if pad_task is not None:
+                image_paths.extend(await pad_task)
             
-            # 检查是否成功生成图片
+            # 关键词在提交前已保证非空（空关键词替换为"音乐"，不足部分用默认关键词填充），
+            # 全部失败通常是 API 不可用，不再用默认关键词重复请求一轮
             if not image_paths:
-                print("警告：未能生成任何图片，尝试使用默认关键词")
-                # 使用默认关键词作为备用
-                default_keywords = ["音乐", "艺术", "自然", "风景", "创意"]
-                image_paths = create_images_for_sentences(default_keywords[:max_images], style, max_images)
+                print("警告：未能生成任何图片")
             
             print(f"\n图片生成完成!")
             print(f"总共成功生成 {len(image_paths)} 张图片")
@@ -183,36 +209,49 @@ def audio_to_images_pipeline(audio_path, style="艺术风格", max_images=8, ext
             
             return image_paths
         except Exception as e:
-            print(f"错误：生成图片过程中发生错误: {e}")
-            # 尝试使用默认图片生成
-            print("尝试使用默认关键词生成图片...")
-            default_keywords = ["音乐", "艺术", "自然", "风景", "创意"]
-            image_paths = create_images_for_sentences(default_keywords[:max_images], style, max_images)
-            return image_paths
+            for task in tasks:
+                task.cancel()
+            return await _fallback_to_default_images(f"错误：生成图片过程中发生错误: {e}", style, max_images)
         
     except Exception as e:
-        print(f"❌ 处理流程出错: {e}")
-        print("详细错误信息:")
-        print(traceback.format_exc())
+        logger.exception("❌ 处理流程出错: %s", e)
         
         # 即使出错也要尝试生成默认图片
-        print("尝试使用默认关键词生成图片...")
-        return generate_default_images(["音乐", "艺术", "抽象", "创意"], style, min(4, max_images))
+        return await _fallback_to_default_images(
+            "处理流程出错", style, min(4, max_images), ["音乐", "艺术", "抽象", "创意"]
+        )
+    finally:
+        # 事件循环结束前关闭图片生成使用的 HTTP 连接
+        await close_async_clients()
 
-def generate_default_images(keywords, style, max_images):
-    """使用默认关键词生成图片"""
-    image_paths = []
-    for i, keyword in enumerate(keywords[:max_images], 1):
-        try:
-            prompt = f"{keyword}，{style}，高清，8K"
-            print(f"尝试生成默认图片 {i}: '{prompt}'")
-            image_path = generate_image(prompt)
-            # 保存图片路径，只添加成功生成的图片
-            if image_path:
-                image_paths.append(image_path)
-        except Exception as e:
-            print(f"生成默认图片失败: {e}")
-    return image_paths
+def audio_to_images_pipeline(audio_path, style="艺术风格", max_images=8, extract_keywords=True):
+    """
+    音频转图片的完整流程
+    
+    参数:
+        audio_path: 音频文件路径
+        style: 生成图片的风格
+        max_images: 最大生成图片数量
+        extract_keywords: 是否提取关键词（否则使用完整句子）
+    
+    返回:
+        生成的图片路径列表
+    """
+    return asyncio.run(audio_to_images_pipeline_async(audio_path, style, max_images, extract_keywords))
+
+async def _fallback_to_default_images(reason, style, max_images, keywords=None):
+    """统一的默认关键词回退：打印原因后用默认关键词生成图片"""
+    keywords = keywords or DEFAULT_KEYWORDS
+    print(f"{reason}，尝试使用默认关键词生成图片: {keywords[:max_images]}")
+    return await generate_default_images_async(keywords, style, max_images)
+
+async def generate_default_images_async(keywords, style, max_images):
+    """使用默认关键词批量生成图片"""
+    keywords = keywords[:max_images]
+    for i, keyword in enumerate(keywords, 1):
+        print(f"尝试生成默认图片 {i}: '{build_prompt(keyword, style)}'")
+    # 只返回成功生成的图片路径，失败的请求在 image_generator 中记录
+    return await generate_images_batch_async(keywords, style)
 
 if __name__ == "__main__":
     # 示例用法
@@ -220,8 +259,8 @@ if __name__ == "__main__":
     
     # 确保必要的目录存在
     print("检查必要的目录...")
-    Path("output/images").mkdir(parents=True, exist_ok=True)
-    Path("output/transcribed").mkdir(parents=True, exist_ok=True)
+    ensure_dir(OUTPUT_IMAGES)
+    ensure_dir(OUTPUT_TRANSCRIBED)
     print("目录检查完成")
     
     parser = argparse.ArgumentParser(description='音频转文字再生成图片的工具')
@@ -235,8 +274,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     # 设置调试模式
-    global _debug_enabled
-    _debug_enabled = args.debug
+    logging.basicConfig(format="[%(asctime)s] %(levelname)s: %(message)s", datefmt="%H:%M:%S")
+    logger.setLevel(logging.DEBUG if args.debug else logging.WARNING)
     
     print(f"\n开始处理音频文件: {args.audio}")
     print(f"使用Whisper模型: {args.model}")
@@ -262,9 +301,7 @@ if __name__ == "__main__":
             print("\n❌ 未能生成任何图片")
             print("请检查错误信息并尝试解决问题")
     except Exception as e:
-        print(f"\n❌ 程序运行出错: {e}")
-        print("详细错误信息:")
-        print(traceback.format_exc())
+        logger.exception("❌ 程序运行出错: %s", e)
         print("\n建议解决方法:")
         print("1. 检查音频文件路径是否正确")
         print("2. 确保有足够的磁盘空间")
@@ -10,37 +10,51 @@
 """
 
 import os
+import re
 import sys
-import traceback
+import mmap
+import logging
+import numpy as np
 from pathlib import Path
-from datetime import datetime
 
 # 添加项目根目录到 Python 路径
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_root)
 
-def debug_print(message):
-    """调试打印函数"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] DEBUG: {message}")
+# 调试输出：未开启 DEBUG 级别时不会格式化参数
+logger = logging.getLogger(__name__)
 
 # 导入必要的模块
 try:
     from audio_to_images import audio_to_images_pipeline
-    debug_print("成功导入 audio_to_images_pipeline")
-except Exception as e:
-    print(f"警告：导入 audio_to_images_pipeline 失败: {e}")
-    print(traceback.format_exc())
+    logger.debug("成功导入 audio_to_images_pipeline")
+except Exception:
+    logger.exception("警告：导入 audio_to_images_pipeline 失败")
     raise
 
 try:
-    from utils.video_creator import VideoCreator
-    debug_print("成功导入 VideoCreator")
-except Exception as e:
-    print(f"警告：导入 VideoCreator 失败: {e}")
-    print(traceback.format_exc())
+    from utils.video_creator import VideoCreator, probe_duration
+    logger.debug("成功导入 VideoCreator")
+except Exception:
+    logger.exception("警告：导入 VideoCreator 失败")
     raise
 
+from config import OUTPUT_IMAGES, OUTPUT_VIDEOS, OUTPUT_TRANSCRIBED, OUTPUT_TRANSCRIBED_PATH, ensure_dir
+
+# 超过该大小的转录文件使用 mmap 读取
+_MMAP_THRESHOLD = 16 * 1024 * 1024
+_WORD_RE = re.compile(rb"\S+")
+
+def read_transcript_words(transcript_path):
+    """以二进制读取转录文件并按空白分词，只做一次 UTF-8 解码"""
+    with open(transcript_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _MMAP_THRESHOLD:
+            return f.read().decode("utf-8").split()
+        # 大文件：在 mmap 上直接用正则切分，不生成完整的中间字符串
+        # 注意：字节正则只识别 ASCII 空白
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [word.decode("utf-8") for word in _WORD_RE.findall(mm)]
+
 def audio_to_video_pipeline(audio_path, style="艺术风格", max_images=8, 
                           extract_keywords=True, output_filename=None, 
                           duration_per_image=None, add_text_overlay=False, 
@@ -117,59 +131,42 @@ def audio_to_video_pipeline(audio_path, style="艺术风格", max_images=8,
             # 尝试从转录文件中获取文字内容
             try:
                 # 获取最近的转录文件
-                transcript_dir = Path("output/transcribed")
+                transcript_dir = OUTPUT_TRANSCRIBED_PATH
                 if transcript_dir.exists():
                     # 查找与当前音频相关的最新转录文件
-                    audio_name = os.path.splitext(os.path.basename(audio_path))[0]
+                    audio_name = Path(audio_path).stem
                     transcript_files = list(transcript_dir.glob(f"{audio_name}_*_transcript.txt"))
                     
                     if transcript_files:
-                        # 按修改时间排序，获取最新的文件
-                        transcript_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-                        latest_transcript = transcript_files[0]
+                        # 一次遍历取修改时间最新的文件
+                        latest_transcript = max(transcript_files, key=lambda x: x.stat().st_mtime)
                         
                         print(f"🔍 找到最近的转录文件: {latest_transcript}")
                         
-                        # 读取转录内容
-                        with open(latest_transcript, "r", encoding="utf-8") as f:
-                            transcript = f.read()
-                        
-                        # 简单分割文本，为每个图片创建一个文字片段
+                        # 读取转录内容并分词
                         # 这里使用简单的策略，实际应用可能需要更复杂的文本分割
-                        words = transcript.split()
-                        segment_length = max(1, len(words) // len(image_paths))
-                        
-                        # 生成文字列表
-                        text_list = []
-                        current_time = 0
+                        words = read_transcript_words(latest_transcript)
                         
                         # 尝试确定每张图片的显示时长
                         if duration_per_image and duration_per_image != "auto":
                             img_duration = duration_per_image
                         else:
-                            # 估算时长
-                            from utils.audio_processor import AudioProcessor
-                            processor = AudioProcessor("tiny")  # 使用tiny模型快速获取音频时长
-                            audio_duration = processor.get_audio_duration(audio_path)
+                            # 读取音频文件头获取时长，无需加载模型
+                            audio_duration = probe_duration(audio_path)
                             img_duration = audio_duration / len(image_paths)
                         
-                        for i in range(len(image_paths)):
-                            start_idx = i * segment_length
-                            end_idx = min((i + 1) * segment_length, len(words))
-                            text = " ".join(words[start_idx:end_idx])
-                            
-                            # 确保文本不为空
-                            if not text and i < len(words):
-                                text = words[i] if i < len(words) else f"图片 {i+1}"
-                            elif not text:
-                                text = f"图片 {i+1}"
-                            
-                            text_list.append({
-                                'text': text,
-                                'start_time': current_time,
-                                'duration': img_duration
-                            })
-                            current_time += img_duration
+                        # 按图片数量均分单词，一次性计算所有分段边界
+                        bounds = np.linspace(0, len(words), len(image_paths) + 1, dtype=int)
+                        texts = [
+                            " ".join(words[start:end]) or f"图片 {i+1}"
+                            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))
+                        ]
+                        
+                        # 生成文字列表，开始时间由下标直接计算，避免累加误差
+                        text_list = [
+                            {'text': text, 'start_time': float(start_time), 'duration': img_duration}
+                            for text, start_time in zip(texts, np.arange(len(texts)) * img_duration)
+                        ]
                         
                         print(f"📝 准备添加 {len(text_list)} 段文字到视频")
                         
@@ -200,9 +197,7 @@ def audio_to_video_pipeline(audio_path, style="艺术风格", max_images=8,
         return video_path
         
     except Exception as e:
-        print(f"\n❌ 处理流程出错: {e}")
-        print("详细错误信息:")
-        print(traceback.format_exc())
+        logger.exception("❌ 处理流程出错: %s", e)
         return None
 
 def main():
@@ -211,8 +206,8 @@ def main():
     
     # 确保必要的目录存在
     print("检查必要的目录...")
-    for dir_path in ["output/images", "output/transcribed", "output/videos"]:
-        Path(dir_path).mkdir(parents=True, exist_ok=True)
+    for dir_path in [OUTPUT_IMAGES, OUTPUT_TRANSCRIBED, OUTPUT_VIDEOS]:
+        ensure_dir(dir_path)
     print("目录检查完成")
     
     parser = argparse.ArgumentParser(description='音频转视频的完整处理工具')
@@ -226,9 +221,17 @@ def main():
     parser.add_argument('--transition', type=float, default=1.0, help='转场动画时长（秒）')
     parser.add_argument('--resolution', help='目标分辨率，格式如 1920x1080')
     parser.add_argument('--beat-sync', action='store_true', help='根据音乐节奏切换图片')
+    parser.add_argument('--debug', action='store_true', help='启用调试输出')
     
     args = parser.parse_args()
     
+    # 设置调试模式
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    
     # 解析分辨率参数
     target_resolution = None
     if args.resolution:
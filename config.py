@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+from pathlib import Path
 
 # 项目路径配置
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -8,14 +10,25 @@ OUTPUT_IMAGES = os.path.join(OUTPUT_DIR, "images")
 OUTPUT_VIDEOS = os.path.join(OUTPUT_DIR, "videos")
 OUTPUT_TRANSCRIBED = os.path.join(OUTPUT_DIR, "transcribed")
 
-# 创建输出目录
-for directory in [INPUT_DIR, OUTPUT_IMAGES, OUTPUT_VIDEOS, OUTPUT_TRANSCRIBED]:
-    os.makedirs(directory, exist_ok=True)
+# 常用路径的 Path 对象，避免调用方重复构造
+OUTPUT_TRANSCRIBED_PATH = Path(OUTPUT_TRANSCRIBED)
+
+# 按需创建输出目录：由写入输出的调用方在首次使用时调用，导入 config 不产生文件系统副作用
+@lru_cache(maxsize=None)
+def ensure_dir(path):
+    """创建目录（如不存在），同一路径只执行一次"""
+    Path(path).mkdir(parents=True, exist_ok=True)
+    return path
 
 # Whisper配置
 WHISPER_CONFIG = {
     "model_size": "base",  # tiny, base, small, medium, large
-    "language": "chinese"  # 自动检测或指定语言
+    "language": "chinese",  # 自动检测或指定语言
+    "backend": "faster-whisper",  # faster-whisper（CTranslate2）或 whisper（openai-whisper）
+    "compute_type": "auto",  # faster-whisper 计算精度：auto（GPU 用 float16，CPU 用 int8）、int8、int8_float16、float16、float32
+    "torch_compile": False,  # whisper 后端是否用 torch.compile 编译编码器（编译延迟到首次转录，后端不可用时会在转录时报错）
+    "cpu_int8": True,  # whisper 后端在 CPU 上是否将 Linear 层动态量化为 int8
+    "batch_size": 16  # 批量推理大小：faster-whisper 为 VAD 切分后的片段数，whisper 为 30 秒窗口数；0 表示逐段解码
 }
 
 # 图像生成配置
@@ -23,7 +36,9 @@ IMAGE_CONFIG = {
     "max_images": 8,           # 最大图像数量
     "min_sentence_length": 5,   # 最小句子长度
     "image_size": "1024x1024",  # 图像尺寸
-    "default_style": "艺术风格"  # 默认图像风格
+    "default_style": "艺术风格",  # 默认图像风格
+    "max_concurrency": 4,       # 并发图像生成请求上限（受 API 限流约束）
+    "batch_api": False          # 一次请求提交多条提示词，仅在服务端支持按提示词批量生成时设为 True
 }
 
 # 视频配置
@@ -35,6 +50,8 @@ VIDEO_CONFIG = {
     "duration_per_image": 5,    # 每张图像显示秒数
     "output_quality": "high",   # 输出质量
     "transition_duration": 1.0, # 转场动画时长
+    "hw_encode": True,          # 检测到 NVENC 时使用 GPU 编码（h264_nvenc）
+    "caption_fontfile": None,   # 字幕字体文件路径，None 时按字体名 SimHei 查找（需要 fontconfig）
     "default_output_format": "mp4"
 }
 
@@ -1,9 +1,15 @@
 import os
+import re
 import sys
+import asyncio
 import argparse
+import atexit
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
+import logging.handlers
 
 # 获取项目根目录
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -12,58 +18,96 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 LOGS_DIR = os.path.join(PROJECT_ROOT, 'logs')
 os.makedirs(LOGS_DIR, exist_ok=True)
 
-# 设置日志配置
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOGS_DIR, 'pipeline.log')),
-        logging.StreamHandler()
-    ]
-)
+# 设置日志配置：调用方只把记录放入队列，文件和终端输出由后台监听线程完成
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler(os.path.join(LOGS_DIR, 'pipeline.log')),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_queue = queue.Queue(-1)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# 入队时只合并消息与异常信息，完整格式由监听端的处理器负责
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+# 退出前停止监听线程，确保队列中剩余的日志全部写出
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# 中英文句子分隔符，预编译避免每次调用重新编译
+_SENT_SPLIT_RE = re.compile(r'[。！？.!?]\s*')
+
 # 模块导入处理
 class DummyTextProcessor:
     """文本处理器的备用实现"""
     def split_sentences(self, text):
-        # 简单的句子分割实现
-        import re
         # 基本的句子分割，支持中英文标点
-        sentences = re.split(r'[。！？.!?]\s*', text)
-        return [s.strip() for s in sentences if s.strip()]
+        return [t for s in _SENT_SPLIT_RE.split(text) if (t := s.strip())]
 
 class DummyImageManager:
     """图像管理器的备用实现"""
     def generate_images_from_sentences(self, sentences):
         # 返回测试图像路径
         test_images_dir = os.path.join(OUTPUT_DIR, 'videos', 'test_images')
-        if os.path.exists(test_images_dir):
-            # 使用现有的测试图像
-            image_paths = []
-            for i in range(min(len(sentences), 10)):  # 最多使用10张图像
-                img_path = os.path.join(test_images_dir, f'test_image_{i+1}.png')
-                if os.path.exists(img_path):
-                    image_paths.append(img_path)
-            return image_paths
-        return []
+        try:
+            # 一次读取目录，代替逐个文件 os.path.exists
+            with os.scandir(test_images_dir) as entries:
+                existing = {entry.name for entry in entries}
+        except FileNotFoundError:
+            return []
+        # 使用现有的测试图像，最多使用10张图像
+        return [os.path.join(test_images_dir, name)
+                for i in range(min(len(sentences), 10))
+                if (name := f'test_image_{i+1}.png') in existing]
+
+# 转录文本和句子文件在后台线程写入，不阻塞后续步骤；所有流水线实例共用一个线程池
+_io_pool = ThreadPoolExecutor(max_workers=2)
+# 退出前等待未写完的文件落盘（先于日志监听线程停止）
+atexit.register(_io_pool.shutdown, wait=True)
+
+
+def _write_text_file(path, content):
+    """在后台线程中写入文本文件，失败时只记录日志"""
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    except OSError as e:
+        logger.error(f"写入文件失败 {path}: {e}")
+
+class DummyAudioProcessor:
+    """语音识别处理器的备用实现"""
+    def __init__(self, model_size):
+        self.model_size = model_size
+    def transcribe_audio(self, audio_path):
+        return "这是一个测试转录文本。用于演示音乐幻灯片功能。"
+    def split_into_sentences(self, text, language):
+        return [t for s in _SENT_SPLIT_RE.split(text) if (t := s.strip())]
+
+def load_audio_processor(model_size):
+    """延迟导入语音识别模块（whisper/torch 冷启动耗时数秒），--help 与测试模式无需加载"""
+    try:
+        from utils.audio_processor import create_audio_processor
+        # whisper/faster_whisper 在创建处理器时才导入，缺失时同样回退
+        return create_audio_processor(model_size)
+    except ImportError:
+        logger.warning("无法导入AudioProcessor，使用简化版本")
+        return DummyAudioProcessor(model_size)
 
 # 尝试导入模块
 try:
-    from utils.audio_processor import AudioProcessor
+    from utils.image_generator import (SILICON_API_KEY, build_prompt, generate_image_async,
+                                       close_async_clients, create_images_for_sentences)
 except ImportError:
-    logger.warning("无法导入AudioProcessor，使用简化版本")
-    class AudioProcessor:
-        def __init__(self, model_size):
-            self.model_size = model_size
-        def transcribe_audio(self, audio_path):
-            return "这是一个测试转录文本。用于演示音乐幻灯片功能。"
-        def split_into_sentences(self, text, language):
-            import re
-            return re.split(r'[。！？.!?]\s*', text)
+    logger.warning("无法导入image_generator，转录期间不预先生成图像")
+    SILICON_API_KEY = None
+    build_prompt = generate_image_async = close_async_clients = create_images_for_sentences = None
 
 try:
     from utils.text_processor import TextProcessor
@@ -108,11 +152,19 @@ class MusicSlideshowPipeline:
             if "model_size" not in WHISPER_CONFIG:
                 raise ValueError("WHISPER_CONFIG中缺少必要的'model_size'配置")
                 
-            self.audio_processor = AudioProcessor(model_size=WHISPER_CONFIG["model_size"])
+            # 同一进程内复用已加载的处理器和模型
+            self.audio_processor = load_audio_processor(WHISPER_CONFIG["model_size"])
             self.text_processor = TextProcessor()
             self.image_manager = ImageManager()
             self.video_creator = VideoCreator()
             
+            # 输出目录只在初始化时创建一次，各步骤不再重复检查
+            self.transcript_dir = os.path.join(OUTPUT_DIR, "transcribed")
+            self.sentences_dir = os.path.join(OUTPUT_DIR, "sentences")
+            for output_dir in (self.transcript_dir, self.sentences_dir,
+                               os.path.join(OUTPUT_DIR, "images"), os.path.join(OUTPUT_DIR, "videos")):
+                os.makedirs(output_dir, exist_ok=True)
+            
             logger.info("音乐幻灯片管道初始化完成")
             print("🎵 音乐幻灯片管道初始化完成!")
             
@@ -159,12 +211,15 @@ class MusicSlideshowPipeline:
             print(f"⏱️  开始时间: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
             print("=" * 60)
             
-            # 步骤1: 语音识别
+            # 步骤1: 语音识别（每识别出一个句子就立即提交图像生成任务）
             print("\n📝 步骤 1/4: 语音识别")
             step_start = time.time()
-            text = self._run_transcription(audio_path, step_results)
+            sentences, image_paths = asyncio.run(
+                self._transcribe_and_generate(audio_path, max_images, step_results)
+            )
             self._log_step_time("语音识别", time.time() - step_start)
             
+            text = step_results["transcription"]
             if not text or len(text.strip()) < 5:
                 print("❌ 语音识别失败或文本太短")
                 return None
@@ -172,17 +227,21 @@ class MusicSlideshowPipeline:
             # 步骤2: 文本处理
             print("\n🔤 步骤 2/4: 文本处理")
             step_start = time.time()
-            sentences = self._process_text(text, step_results)
+            sentences = self._process_text(text, sentences, step_results)
             self._log_step_time("文本处理", time.time() - step_start)
             
             if not sentences:
                 print("❌ 无法从文本中提取有效句子")
                 return None
             
-            # 步骤3: 图像生成
+            # 步骤3: 图像生成（已与语音识别并行完成，失败时回退到图像管理器）
             print("\n🎨 步骤 3/4: 图像生成")
             step_start = time.time()
-            image_paths = self._generate_images(sentences, max_images, step_results)
+            if image_paths:
+                self._report_images(image_paths)
+                step_results["image_paths"] = image_paths
+            else:
+                image_paths = self._generate_images(sentences, max_images, step_results)
             self._log_step_time("图像生成", time.time() - step_start)
             
             if not image_paths:
@@ -232,22 +291,36 @@ class MusicSlideshowPipeline:
             return None
     
     def _run_transcription(self, audio_path, step_results):
-        """执行语音识别"""
+        """执行语音识别，逐句产出识别结果，全部识别完成后保存转录文本"""
         try:
-            text = self.audio_processor.transcribe_audio(audio_path)
+            language = WHISPER_CONFIG.get("language", "zh")
+            if hasattr(self.audio_processor, "transcribe_stream"):
+                from utils.audio_processor import split_sentence_tail
+                
+                # 逐段识别，每完成一段就切分并产出其中已结束的句子；
+                # 片段末尾未结束的半句拼接到下一段之前，识别结束时再产出
+                segments, tail = [], ""
+                for chunk, _start, _end in self.audio_processor.transcribe_stream(audio_path):
+                    segments.append(chunk)
+                    complete, tail = split_sentence_tail(tail + chunk)
+                    if complete:
+                        yield from self.audio_processor.split_into_sentences(complete, language)
+                if tail.strip():
+                    yield from self.audio_processor.split_into_sentences(tail, language)
+                text = "".join(segments).strip()
+            else:
+                text = self.audio_processor.transcribe_audio(audio_path)
+                yield from self.audio_processor.split_into_sentences(text, language)
+                text = text.strip()
             
             # 保存转录文本
-            transcript_dir = os.path.join(OUTPUT_DIR, "transcribed")
-            os.makedirs(transcript_dir, exist_ok=True)
-            
             base_name = os.path.splitext(os.path.basename(audio_path))[0]
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            transcript_file = os.path.join(transcript_dir, f"{base_name}_{timestamp}_transcript.txt")
+            transcript_file = os.path.join(self.transcript_dir, f"{base_name}_{timestamp}_transcript.txt")
             
-            with open(transcript_file, 'w', encoding='utf-8') as f:
-                f.write(text)
+            _io_pool.submit(_write_text_file, transcript_file, text)
             
-            print(f"✅ 转录文本已保存: {transcript_file}")
+            print(f"✅ 转录文本保存至: {transcript_file}")
             print(f"📝 识别到文本 ({len(text)} 字符)")
             
             # 显示文本预览
@@ -257,38 +330,77 @@ class MusicSlideshowPipeline:
                 print(f"   文本内容: {text}")
                 
             step_results["transcription"] = text
-            return text
             
         except Exception as e:
             logger.error(f"语音识别失败: {e}")
             raise RuntimeError(f"语音识别出错: {str(e)}")
     
-    def _process_text(self, text, step_results):
-        """处理识别到的文本"""
+    async def _transcribe_and_generate(self, audio_path, max_images, step_results):
+        """
+        边转录边生成图像：识别线程逐句产出，每个句子立即提交异步图像生成任务
+        
+        Returns:
+            tuple: (句子列表, 成功生成的图像路径列表)
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        
+        def produce():
+            try:
+                for sentence in self._run_transcription(audio_path, step_results):
+                    loop.call_soon_threadsafe(queue.put_nowait, sentence)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+        
+        # 未配置 API 密钥时只收集句子，图像交给图像管理器生成
+        can_generate = generate_image_async is not None and bool(SILICON_API_KEY)
+        limit = max_images if max_images is not None else IMAGE_CONFIG.get("max_images")
+        semaphore = asyncio.Semaphore(IMAGE_CONFIG.get("max_concurrency", 4))
+        sentences, tasks = [], []
+        
+        async def consume():
+            while (sentence := await queue.get()) is not None:
+                sentences.append(sentence)
+                if can_generate and (limit is None or len(tasks) < limit):
+                    tasks.append(asyncio.create_task(
+                        generate_image_async(build_prompt(sentence), semaphore)
+                    ))
+        
+        try:
+            try:
+                await asyncio.gather(asyncio.to_thread(produce), consume())
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            
+            image_paths = [path for path in await asyncio.gather(*tasks) if path]
+            return sentences, image_paths
+        finally:
+            # 事件循环结束前关闭图像生成使用的 HTTP 连接
+            if close_async_clients is not None:
+                await close_async_clients()
+    
+    def _process_text(self, text, sentences, step_results):
+        """整理识别到的句子并保存"""
         try:
             # 获取语言配置
             language = WHISPER_CONFIG.get("language", "zh")
             print(f"🌐 检测语言: {language}")
             
-            sentences = self.audio_processor.split_into_sentences(text, language)
-            
             if not sentences:
                 # 尝试使用文本处理器的备用分割方法
                 sentences = self.text_processor.split_sentences(text)
             
             # 保存句子到文件
             if sentences:
-                sentences_dir = os.path.join(OUTPUT_DIR, "sentences")
-                os.makedirs(sentences_dir, exist_ok=True)
-                
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                sentences_file = os.path.join(sentences_dir, f"sentences_{timestamp}.txt")
+                sentences_file = os.path.join(self.sentences_dir, f"sentences_{timestamp}.txt")
                 
-                with open(sentences_file, 'w', encoding='utf-8') as f:
-                    for i, sentence in enumerate(sentences, 1):
-                        f.write(f"{i}. {sentence}\n")
+                content = "".join(f"{i}. {sentence}\n" for i, sentence in enumerate(sentences, 1))
+                _io_pool.submit(_write_text_file, sentences_file, content)
                 
-                print(f"✅ 句子文件已保存: {sentences_file}")
+                print(f"✅ 句子文件保存至: {sentences_file}")
                 print(f"📄 识别到 {len(sentences)} 个句子")
                 
                 # 显示前3个句子
@@ -319,23 +431,18 @@ class MusicSlideshowPipeline:
                 print(f"✂️  句子数量过多，将前 {max_images} 个句子用于图像生成")
                 sentences = sentences[:max_images]
             
-            # 生成图像
-            image_paths = self.image_manager.generate_images_from_sentences(sentences)
+            # 生成图像：已配置 API 密钥时用 asyncio 并发请求（信号量限制并发数），否则交给图像管理器
+            if create_images_for_sentences is not None and SILICON_API_KEY:
+                image_paths = create_images_for_sentences(sentences, max_imgs=len(sentences))
+            else:
+                image_paths = self.image_manager.generate_images_from_sentences(sentences)
             
             # 恢复原始配置
             if original_max is not None:
                 IMAGE_CONFIG["max_images"] = original_max
             
             # 验证图像生成
-            if image_paths:
-                print(f"✅ 成功生成 {len(image_paths)} 张图像")
-                # 显示生成的图像路径
-                for i, img_path in enumerate(image_paths[:5], 1):
-                    print(f"   {i}. {os.path.basename(img_path)}")
-                if len(image_paths) > 5:
-                    print(f"   ... 等 {len(image_paths) - 5} 张图像")
-            else:
-                print("❌ 图像生成失败或没有返回有效图像路径")
+            self._report_images(image_paths)
                 
             step_results["image_paths"] = image_paths
             return image_paths
@@ -344,6 +451,18 @@ class MusicSlideshowPipeline:
             logger.error(f"图像生成失败: {e}")
             raise RuntimeError(f"图像生成出错: {str(e)}")
     
+    def _report_images(self, image_paths):
+        """显示图像生成结果"""
+        if image_paths:
+            print(f"✅ 成功生成 {len(image_paths)} 张图像")
+            # 显示生成的图像路径
+            for i, img_path in enumerate(image_paths[:5], 1):
+                print(f"   {i}. {os.path.basename(img_path)}")
+            if len(image_paths) > 5:
+                print(f"   ... 等 {len(image_paths) - 5} 张图像")
+        else:
+            print("❌ 图像生成失败或没有返回有效图像路径")
+    
     def _create_video(self, image_paths, audio_path, output_name, 
                      transition_type, video_resolution, step_results):
         """创建视频"""
@@ -388,8 +507,9 @@ class MusicSlideshowPipeline:
             raise RuntimeError(f"视频合成出错: {str(e)}")
     
     def _log_step_time(self, step_name, seconds):
-        """记录步骤执行时间"""
+        """记录步骤执行时间，并在步骤边界统一刷新一次标准输出"""
         print(f"✅ {step_name}完成! 耗时: {seconds:.2f} 秒")
+        sys.stdout.flush()
     
     def _cleanup_resources(self, step_results):
         """清理部分生成的资源（可选）"""
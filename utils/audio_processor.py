@@ -1,18 +1,130 @@
-import whisper
 import os
-from pydub import AudioSegment
-import tempfile
+import re
+import sys
+import functools
+import threading
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WHISPER_CONFIG
+
+# 分句正则在模块加载时编译一次，中英文标点合并为一个字符集，单次扫描即可完成分句
+_SENT_SPLIT = re.compile(r"[^。！？.!?…]+")
+# 最后一个句末标点之后的内容：流式转录时属于尚未结束的句子
+_SENT_TAIL = re.compile(r"[^。！？.!?…]*\Z")
+
+# torch.compile 的 inductor 缓存目录，跨进程复用已编译的内核
+WHISPER_COMPILE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "whisper_compile")
+
+
+def _resolve_device(compute_type):
+    """
+    检测 CUDA 并确定 faster-whisper 的设备与计算精度
+    compute_type 为 "auto" 时：GPU 使用 float16，CPU 使用 int8
+    """
+    try:
+        import ctranslate2
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    except Exception:
+        device = "cpu"
+    if compute_type in (None, "auto"):
+        compute_type = "float16" if device == "cuda" else "int8"
+    return device, compute_type
+
+
+def split_sentence_tail(text):
+    """
+    将文本拆成 (以句末标点结尾的部分, 未结束的尾部)
+    
+    流式转录时识别片段的边界不一定落在句末，尾部应拼接到下一段文本之前再分句，
+    转录结束后再单独处理剩余的尾部
+    """
+    tail_start = _SENT_TAIL.search(text).start()
+    return text[:tail_start], text[tail_start:]
+
+
+# 保证多线程同时首次加载时只加载一次模型
+_MODEL_LOCK = threading.Lock()
+
+
+def _load_model(model_size, backend, compute_type):
+    """线程安全地获取缓存的 Whisper 模型，同一进程内相同配置只加载一次"""
+    with _MODEL_LOCK:
+        return _cached_model(model_size, backend, compute_type)
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_model(model_size, backend, compute_type):
+    """加载 Whisper 模型，结果按 (模型大小, 后端, 精度) 缓存"""
+    if backend == "faster-whisper":
+        from faster_whisper import WhisperModel
+        device, compute_type = _resolve_device(compute_type)
+        print(f"faster-whisper 设备: {device}, 计算精度: {compute_type}")
+        return WhisperModel(model_size, device=device, compute_type=compute_type)
+    
+    # whisper 会连带导入 torch，冷启动耗时数秒，只在使用 whisper 后端时才导入
+    import whisper
+    model = whisper.load_model(model_size)
+    if next(model.parameters()).device.type == "cpu" and WHISPER_CONFIG.get("cpu_int8", True):
+        try:
+            return _quantize_linear_int8(model)
+        except Exception as e:
+            print(f"int8 动态量化失败，使用 fp32 模型: {e}")
+    if model.device.type == "cuda":
+        import torch
+        # 允许 TF32 矩阵乘法，注意力优先走 FlashAttention 内核（与是否编译无关）
+        torch.set_float32_matmul_precision("high")
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cuda.enable_flash_sdp(True)
+    if WHISPER_CONFIG.get("torch_compile", False):
+        try:
+            import torch
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", WHISPER_COMPILE_CACHE)
+            # GPU 上用 CUDA Graphs 消除逐个 kernel 的启动开销，首次调用需额外预热
+            mode = "reduce-overhead" if torch.cuda.is_available() else "default"
+            model.encoder = torch.compile(model.encoder, mode=mode, fullgraph=True)
+        except Exception as e:
+            print(f"torch.compile 不可用，使用 eager 模式: {e}")
+    return model
+
+
+def _quantize_linear_int8(model):
+    """CPU 上将 Linear 层动态量化为 int8，卷积层与 mel 频谱计算仍为 fp32"""
+    import torch
+    # whisper 的 Linear 子类只在前向时做 dtype 转换，CPU 上权重本就是 fp32，
+    # 还原为 nn.Linear 后才能被 quantize_dynamic 识别
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear):
+            module.__class__ = torch.nn.Linear
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    print("whisper 运行在 CPU 上，Linear 层已量化为 int8")
+    return model
+
 
 class AudioProcessor:
-    def __init__(self, model_size="base"):
+    def __init__(self, model_size="base", backend=None, compute_type=None):
         """
         初始化语音识别处理器
         model_size: "tiny", "base", "small", "medium", "large"
+        backend: "faster-whisper" 或 "whisper"，默认读取 WHISPER_CONFIG["backend"]
+        compute_type: faster-whisper 计算精度，默认读取 WHISPER_CONFIG["compute_type"]
         """
-        print(f"正在加载Whisper模型 ({model_size})...")
-        self.model = whisper.load_model(model_size)
+        self.backend = backend or WHISPER_CONFIG.get("backend", "whisper")
+        self.compute_type = compute_type or WHISPER_CONFIG.get("compute_type", "auto")
+        
+        print(f"正在加载Whisper模型 ({model_size}, 后端: {self.backend})...")
+        self.model = _load_model(model_size, self.backend, self.compute_type)
+        self._batched_pipeline = None
         print("Whisper模型加载完成！")
     
+    def _get_batched_pipeline(self):
+        """懒加载 faster-whisper 的 BatchedInferencePipeline（VAD 切分 + 批量推理）"""
+        if self._batched_pipeline is None:
+            from faster_whisper import BatchedInferencePipeline
+            self._batched_pipeline = BatchedInferencePipeline(model=self.model)
+        return self._batched_pipeline
+    
     def get_audio_duration(self, audio_path):
         """
         获取音频文件时长
@@ -23,44 +135,37 @@ class AudioProcessor:
         返回:
             音频时长（秒）
         """
+        # 与视频合成共用同一个时长读取函数，只读取容器头部信息，不解码音频数据
+        try:
+            from utils.video_creator import probe_duration
+            return probe_duration(audio_path)
+        except Exception as e:
+            print(f"读取音频时长失败，使用备用方法: {e}")
+        
         try:
-            # 简单使用 wave 或 librosa 获取音频时长
             if audio_path.lower().endswith('.wav'):
                 import wave
                 with wave.open(audio_path, 'r') as w:
-                    frames = w.getnframes()
-                    rate = w.getframerate()
-                    duration = frames / float(rate)
-                    return duration
-            else:
-                # 尝试使用 librosa（如果可用）
-                try:
-                    import librosa
-                    duration = librosa.get_duration(filename=audio_path)
-                    return duration
-                except ImportError:
-                    # 如果没有 librosa，尝试使用 pydub
-                    try:
-                        from pydub import AudioSegment
-                        audio = AudioSegment.from_file(audio_path)
-                        return len(audio) / 1000.0  # 转换为秒
-                    except Exception:
-                        # 最简单的回退方法 - 估算
-                        file_size = os.path.getsize(audio_path) / (1024 * 1024)  # MB
-                        # 假设平均比特率为 128 kbps
-                        estimated_duration = (file_size * 8 * 1024) / 128
-                        return max(1, estimated_duration)  # 至少返回1秒
+                    return w.getnframes() / float(w.getframerate())
+            
+            # 最简单的回退方法 - 估算
+            file_size = os.path.getsize(audio_path) / (1024 * 1024)  # MB
+            # 假设平均比特率为 128 kbps
+            estimated_duration = (file_size * 8 * 1024) / 128
+            return max(1, estimated_duration)  # 至少返回1秒
         except Exception as e:
             print(f"获取音频时长失败: {e}")
             return 60  # 默认返回60秒作为安全值
     
-    def transcribe_audio(self, audio_path, language=None):
+    def transcribe_audio(self, audio_path, language=None, batch_size=None):
         """
         转录音频文件为文本
         
         参数:
-            audio_path: 音频文件路径
+            audio_path: 音频文件路径（mp3 等格式由 ffmpeg 直接解码，无需先转 wav）
             language: 指定语言代码，如 'zh'、'en'，默认为 None（自动检测）
+            batch_size: faster-whisper 批量推理的批大小，默认读取 WHISPER_CONFIG["batch_size"]，
+                        设为 0 时逐段解码
         
         返回:
             转录的文本内容
@@ -70,71 +175,143 @@ class AudioProcessor:
             if not os.path.exists(audio_path):
                 raise FileNotFoundError(f"音频文件不存在: {audio_path}")
             
-            # 如果不是 wav 格式，先转换
-            if not audio_path.lower().endswith('.wav'):
-                print(f"音频格式不是 wav，正在转换: {audio_path}")
-                audio_path = self.convert_to_wav(audio_path)
+            if self.backend == "faster-whisper":
+                if batch_size is None:
+                    batch_size = WHISPER_CONFIG.get("batch_size", 16)
+                return self._transcribe_faster_whisper(audio_path, language, batch_size)
             
-            # 加载音频
-            audio = whisper.load_audio(audio_path)
-            # 处理长音频
-            audio = whisper.pad_or_trim(audio)
-            
-            # 制作梅尔频谱图
-            mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
-            
-            # 如果未指定语言，自动检测
+            # openai-whisper 的 transcribe 按 30 秒窗口滑动处理整段音频
+            # CPU 上（含 int8 量化模型）只能用 fp32 推理
+            result = self.model.transcribe(
+                audio_path, language=language, fp16=self.model.device.type == "cuda"
+            )
             if language is None:
-                _, probs = self.model.detect_language(mel)
-                detected_language = max(probs, key=probs.get)
-                print(f"检测到的语言: {detected_language}")
-                language = detected_language
+                print(f"检测到的语言: {result.get('language')}")
             
-            # 解码音频
-            options = whisper.DecodingOptions(language=language)
-            result = whisper.decode(self.model, mel, options)
-            
-            return result.text
+            return result["text"].strip()
         except Exception as e:
             print(f"转录音频失败: {e}")
             return ""
     
+    def transcribe_stream(self, audio_path, language=None):
+        """
+        逐段转录音频，每完成一段（whisper 后端为一批窗口）就立即产出，便于下游边转录边处理
+        
+        参数:
+            audio_path: 音频文件路径
+            language: 指定语言代码，默认为 None（自动检测）
+        
+        返回:
+            生成器，产出 (文本, 开始时间, 结束时间) 元组，时间单位为秒
+        """
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"音频文件不存在: {audio_path}")
+        
+        if self.backend == "faster-whisper":
+            # faster-whisper 的 segments 本身就是惰性生成器
+            segments = self._faster_whisper_segments(
+                audio_path, language, WHISPER_CONFIG.get("batch_size", 16)
+            )
+            for segment in segments:
+                yield segment.text, segment.start, segment.end
+            return
+        
+        import torch
+        import whisper
+        audio = whisper.load_audio(audio_path)
+        sample_rate = whisper.audio.SAMPLE_RATE
+        chunk_samples = whisper.audio.N_SAMPLES  # 30 秒窗口
+        n_mels = self.model.dims.n_mels
+        # DecodingOptions 默认 fp16=True，CPU 上（含 int8 量化模型）需改用 fp32
+        fp16 = self.model.device.type == "cuda"
+        # 每批若干个 30 秒窗口堆叠成 (N, n_mels, 3000) 一次解码，batch_size 为 0 时逐窗口解码
+        batch = max(1, WHISPER_CONFIG.get("batch_size", 16))
+        offsets = range(0, max(len(audio), 1), chunk_samples)
+        
+        for i in range(0, len(offsets), batch):
+            chunks = [(offset, audio[offset:offset + chunk_samples]) for offset in offsets[i:i + batch]]
+            mels = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(chunk), n_mels=n_mels)
+                for _, chunk in chunks
+            ]).to(self.model.device)
+            
+            if language is None:
+                _, probs = self.model.detect_language(mels[0])
+                language = max(probs, key=probs.get)
+                print(f"检测到的语言: {language}")
+            
+            results = whisper.decode(self.model, mels, whisper.DecodingOptions(language=language, fp16=fp16))
+            for (offset, chunk), result in zip(chunks, results):
+                yield result.text, offset / sample_rate, (offset + len(chunk)) / sample_rate
+    
+    def _transcribe_faster_whisper(self, audio_path, language=None, batch_size=None):
+        """使用 faster-whisper 转录，直接读取 mp3 等格式，无需先转 wav"""
+        segments = self._faster_whisper_segments(audio_path, language, batch_size)
+        return "".join(segment.text for segment in segments).strip()
+    
+    def _faster_whisper_segments(self, audio_path, language=None, batch_size=None):
+        """faster-whisper 转录（VAD + beam search），返回惰性的 segments 生成器"""
+        if batch_size:
+            # VAD 切出语音片段后，每批 batch_size 个片段并行送入编码器
+            segments, info = self._get_batched_pipeline().transcribe(
+                audio_path, language=language, vad_filter=True, beam_size=5, batch_size=batch_size
+            )
+        else:
+            segments, info = self.model.transcribe(
+                audio_path, language=language, vad_filter=True, beam_size=5
+            )
+        if language is None:
+            print(f"检测到的语言: {info.language}")
+        return segments
+    
     def convert_to_wav(self, audio_path):
         """
         将音频转换为WAV格式（如果需要）
+        
+        直接调用 ffmpeg 一次转换为 16 kHz 单声道 PCM（Whisper 的输入格式），
+        不在 Python 中保存采样数据
         """
-        if audio_path.lower().endswith('.mp3'):
-            print("正在转换MP3到WAV格式...")
-            audio = AudioSegment.from_mp3(audio_path)
-            wav_path = audio_path.replace('.mp3', '.wav')
-            audio.export(wav_path, format="wav")
-            return wav_path
-        return audio_path
+        if audio_path.lower().endswith('.wav'):
+            return audio_path
+        
+        print("正在转换音频到WAV格式...")
+        wav_path = os.path.splitext(audio_path)[0] + '.wav'
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", audio_path, "-ar", "16000", "-ac", "1", "-c:a", "pcm_s16le", wav_path],
+            check=True, capture_output=True
+        )
+        return wav_path
     
     def split_into_sentences(self, text, language='chinese'):
         """
         将文本分割成句子
+        language 参数仅为兼容保留，中英文标点统一处理
         """
-        # 简单的分句逻辑（中文以句号、问号、感叹号分割）
-        import re
-        
-        if language == 'chinese':
-            # 中文分句
-            sentences = re.split(r'[。！？!?]', text)
-        else:
-            # 英文分句
-            sentences = re.split(r'[.!?]', text)
-        
-        # 过滤空字符串和空白句子
-        sentences = [s.strip() for s in sentences if s.strip()]
+        # 按中英文句号、问号、感叹号分割，过滤空字符串和空白句子
+        sentences = [s for m in _SENT_SPLIT.finditer(text) if (s := m.group().strip())]
         
         print(f"分割为 {len(sentences)} 个句子")
         return sentences
 
+
+@functools.lru_cache(maxsize=4)
+def _get_processor(model_size):
+    """按模型大小缓存音频处理器，同一进程内只加载一次模型"""
+    return AudioProcessor(
+        model_size,
+        backend=WHISPER_CONFIG.get("backend"),
+        compute_type=WHISPER_CONFIG.get("compute_type")
+    )
+
+
+def create_audio_processor(model_size=None):
+    """根据 WHISPER_CONFIG 获取（缓存的）音频处理器"""
+    return _get_processor(model_size or WHISPER_CONFIG["model_size"])
+
 if __name__ == "__main__":
     processor = AudioProcessor("base")
     video_file = "input/audio/The_Beatles_-_Yellow_Submarine_47950273.mp3"      # 换成你的 MP4
     text = processor.transcribe_audio(video_file)   # 无需先转 WAV
     sentences = processor.split_into_sentences(text, language='chinese')
     print("整段文本：\n", text)
-    print("分句结果：\n", sentences)
\ No newline at end of file
+    print("分句结果：\n", sentences)
@@ -5,75 +5,330 @@
 依赖：pip install openai
 """
 import openai
-import requests
+import asyncio
+import contextlib
+import functools
+import hashlib
+import shutil
+import weakref
 from pathlib import Path
 from datetime import datetime
 import os
 import httpx
 import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import IMAGE_CONFIG, OUTPUT_IMAGES, ensure_dir
+
 # ========== 配置 ==========
 SILICON_API_KEY = os.getenv("SILICON_API_KEY")
 SILICON_BASE_URL = "https://api.siliconflow.cn/v1"          # 官方入口
+KOLORS_MODEL = "Kwai-Kolors/Kolors"                         # 硅基流动模型 ID
+
+# 图片下载的分块大小
+_DOWNLOAD_CHUNK = 64 * 1024
+
+# 按提示词内容哈希缓存已生成的图片，歌曲副歌等重复句子不再重复请求 API
+_IMAGE_CACHE_DIR = Path(OUTPUT_IMAGES) / ".cache"
 
-# 检查API密钥是否设置
-if not SILICON_API_KEY:
-    print("警告: 未设置 SILICON_API_KEY 环境变量，请在使用前设置")
-    print("使用方法: export SILICON_API_KEY='your_api_key' (Linux/Mac) 或 set SILICON_API_KEY=your_api_key (Windows)")
-    _client = None
-else:
-    # 清理代理设置
+
+@functools.lru_cache(maxsize=1)
+def _clear_proxy_env():
+    """清理代理设置（只执行一次），需在创建任何 httpx 客户端之前调用"""
     for _k in ("HTTP_PROXY","HTTPS_PROXY","ALL_PROXY","http_proxy","https_proxy","all_proxy","NO_PROXY","no_proxy"):
         os.environ.pop(_k, None)
     os.environ["NO_PROXY"] = "*"
+
+
+def _new_http_client(client_cls, **kwargs):
+    """创建启用 HTTP/2 的 httpx 客户端（或传输层）；未安装 h2 时退回 HTTP/1.1 keep-alive"""
+    _clear_proxy_env()
+    try:
+        return client_cls(http2=True, **kwargs)
+    except ImportError:
+        return client_cls(**kwargs)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """首次调用时创建 OpenAI 客户端并缓存，未设置 API 密钥或初始化失败时返回 None"""
+    # 检查API密钥是否设置
+    if not SILICON_API_KEY:
+        print("警告: 未设置 SILICON_API_KEY 环境变量，请在使用前设置")
+        print("使用方法: export SILICON_API_KEY='your_api_key' (Linux/Mac) 或 set SILICON_API_KEY=your_api_key (Windows)")
+        return None
     try:
-        _client = openai.OpenAI(api_key=SILICON_API_KEY, base_url=SILICON_BASE_URL, http_client=httpx.Client())
+        http_client = _new_http_client(
+            httpx.Client,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=32),
+            timeout=60.0
+        )
+        return openai.OpenAI(api_key=SILICON_API_KEY, base_url=SILICON_BASE_URL, http_client=http_client)
     except Exception as e:
         print(f"错误: 初始化 OpenAI 客户端失败: {e}")
-        _client = None
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _get_download_client():
+    """同步下载共用一个连接池，避免每张图片重新握手 TLS"""
+    return _new_http_client(
+        httpx.Client, limits=httpx.Limits(max_keepalive_connections=16), timeout=30.0
+    )
+
+
+# 异步客户端按事件循环缓存：httpx 连接池绑定创建它的事件循环，
+# 同一循环内的所有请求共享连接（HTTP/2 多路复用），循环结束后自动释放
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _get_async_clients():
+    """返回当前事件循环的 (AsyncOpenAI, httpx.AsyncClient)，未设置 API 密钥时返回 None"""
+    if not SILICON_API_KEY:
+        return None
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        # 连接池按服务端并发上限设置，gather 大量任务时复用连接而不是各开一个 TCP 连接；
+        # 传输层对连接失败自动重试，避免偶发错误浪费一个句子的生成机会
+        transport = _new_http_client(
+            httpx.AsyncHTTPTransport,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+            retries=2
+        )
+        http_client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(60.0, connect=10.0))
+        async_client = openai.AsyncOpenAI(api_key=SILICON_API_KEY, base_url=SILICON_BASE_URL,
+                                          http_client=http_client)
+        clients = _async_clients[loop] = (async_client, http_client)
+    return clients
+
+
+async def close_async_clients():
+    """关闭当前事件循环的异步客户端，需在 asyncio.run 结束事件循环之前调用"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients[1].aclose()
+
+# 正在生成中的提示词按事件循环记录，同一轮中重复的提示词（如副歌）等待同一个任务
+_inflight = weakref.WeakKeyDictionary()
+
+# ========== 提示词 ==========
+@functools.lru_cache(maxsize=256)
+def build_prompt(keyword: str, style: str = "艺术风格") -> str:
+    """拼接关键词与风格后缀，重复的 (关键词, 风格) 直接命中缓存"""
+    return f"{keyword}，{style}，高清，8K"
+
 
 # ========== 生成函数 ==========
+def _cache_path(prompt: str, size: str) -> Path:
+    """提示词与尺寸对应的缓存文件路径"""
+    digest = hashlib.sha1(f"{size}|{prompt}".encode("utf-8")).hexdigest()
+    return _IMAGE_CACHE_DIR / f"{digest}.png"
+
+
+def _store_in_cache(save_path: str, cache_path: Path) -> None:
+    """把新生成的图片复制进缓存，先写临时文件再替换，避免并发读到半张图片"""
+    try:
+        ensure_dir(cache_path.parent)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        shutil.copyfile(save_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"警告: 写入图片缓存失败: {e}")
+
+
+def _download_image(img_url: str,
+                    save_dir: str = "output/images",
+                    save_name: str = None) -> str:
+    """下载图片到本地并返回保存路径"""
+    ensure_dir(save_dir)
+    # 并发生成时同一秒内会有多张图，文件名精确到微秒避免覆盖
+    file_name = save_name or f"kolors_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.png"
+    save_path = Path(save_dir) / file_name
+    # 分块流式写入磁盘，不在内存中保留整张图片
+    with _get_download_client().stream("GET", img_url) as r, open(save_path, "wb") as f:
+        r.raise_for_status()
+        for chunk in r.iter_bytes(_DOWNLOAD_CHUNK):
+            f.write(chunk)
+
+    print(f"[INFO] 图片已保存：{save_path}")
+    return str(save_path)
+
+
 def generate_image(prompt: str,
                    size: str = "1024x1024",
                    save_dir: str = "output/images",
                    save_name: str = None) -> str:
-    """生成单张图并下载到本地"""
-    if _client is None:
+    """生成单张图并下载到本地，相同提示词直接返回缓存的图片"""
+    cache_path = _cache_path(prompt, size)
+    if cache_path.exists():
+        print(f"[INFO] 命中图片缓存：{cache_path}")
+        return str(cache_path)
+    
+    client = _get_client()
+    if client is None:
         print("错误: 无法生成图片 - OpenAI 客户端未初始化，请检查 SILICON_API_KEY 环境变量")
         return None
     
     try:
-        resp = _client.images.generate(
-            model="Kwai-Kolors/Kolors",   # 硅基流动模型 ID
+        resp = client.images.generate(
+            model=KOLORS_MODEL,
             prompt=prompt,
             size=size,
             n=1
         )
-        img_url = resp.data[0].url
-
-        Path(save_dir).mkdir(parents=True, exist_ok=True)
-        file_name = save_name or f"kolors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        save_path = Path(save_dir) / file_name
-        save_path.write_bytes(requests.get(img_url, timeout=30).content)
-
-        print(f"[INFO] 图片已保存：{save_path}")
-        return str(save_path)
+        save_path = _download_image(resp.data[0].url, save_dir, save_name)
+        _store_in_cache(save_path, cache_path)
+        return save_path
     except Exception as e:
         print(f"错误: 生成图片失败: {e}")
         return None
 
 
+# ========== 并发生成 ==========
+async def generate_image_async(prompt: str,
+                               semaphore: asyncio.Semaphore = None,
+                               size: str = "1024x1024",
+                               save_dir: str = "output/images",
+                               save_name: str = None) -> str:
+    """
+    异步生成单张图并下载到本地，semaphore 用于限制并发请求数；
+    相同提示词直接返回缓存的图片，同时进行中的相同提示词只请求一次 API
+    """
+    cache_path = _cache_path(prompt, size)
+    if cache_path.exists():
+        print(f"[INFO] 命中图片缓存：{cache_path}")
+        return str(cache_path)
+    
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    task = inflight.get(cache_path)
+    if task is None:
+        task = asyncio.create_task(
+            _generate_image_uncached(prompt, cache_path, semaphore, size, save_dir, save_name)
+        )
+        inflight[cache_path] = task
+        task.add_done_callback(lambda _: inflight.pop(cache_path, None))
+    # shield：某个调用方被取消时不影响其他等待同一提示词的调用方
+    return await asyncio.shield(task)
+
+
+async def _generate_image_uncached(prompt, cache_path, semaphore, size, save_dir, save_name):
+    """请求 API 生成图片并下载，成功后写入缓存"""
+    clients = _get_async_clients()
+    if clients is None:
+        print("错误: 无法生成图片 - OpenAI 客户端未初始化，请检查 SILICON_API_KEY 环境变量")
+        return None
+    async_client, http_client = clients
+
+    async with semaphore or contextlib.nullcontext():
+        try:
+            resp = await async_client.images.generate(
+                model=KOLORS_MODEL,
+                prompt=prompt,
+                size=size,
+                n=1
+            )
+            # 磁盘读写放到线程中执行，不阻塞事件循环里其他图片的下载
+            await asyncio.to_thread(ensure_dir, save_dir)
+            file_name = save_name or f"kolors_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.png"
+            save_path = Path(save_dir) / file_name
+
+            async with http_client.stream("GET", resp.data[0].url, timeout=30) as r:
+                r.raise_for_status()
+                f = await asyncio.to_thread(open, save_path, "wb")
+                try:
+                    async for chunk in r.aiter_bytes(_DOWNLOAD_CHUNK):
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+
+            print(f"[INFO] 图片已保存：{save_path}")
+            await asyncio.to_thread(_store_in_cache, save_path, cache_path)
+            return str(save_path)
+        except Exception as e:
+            print(f"错误: 生成图片失败: {e}")
+            return None
+
+
+async def generate_images_async(prompts: list[str],
+                                max_concurrency: int = None,
+                                semaphore: asyncio.Semaphore = None) -> list[str]:
+    """
+    并发生成多张图片，按提示词顺序返回成功生成的图片路径
+    
+    传入 semaphore 时与其他同时进行的生成任务共用同一个并发上限
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrency or IMAGE_CONFIG.get("max_concurrency", 4))
+    results = await asyncio.gather(
+        *[generate_image_async(prompt, semaphore) for prompt in prompts],
+        return_exceptions=True
+    )
+    paths = []
+    for prompt, result in zip(prompts, results):
+        if isinstance(result, Exception):
+            print(f"错误: 生成图片失败 '{prompt}': {result}")
+        elif result:  # 只添加成功生成的图片路径
+            paths.append(result)
+    return paths
+
+
+# ========== 批量提交 ==========
+async def generate_images_batch_async(prompts: list[str],
+                                      style: str = "艺术风格",
+                                      size: str = "1024x1024",
+                                      semaphore: asyncio.Semaphore = None) -> list[str]:
+    """
+    一次请求提交全部提示词（仅在 IMAGE_CONFIG["batch_api"] 显式设为 True 时），
+    否则或批量请求失败、返回数量不符时并发逐条生成（semaphore 同 generate_images_async）
+
+    标准接口会忽略 extra_body 中的 prompts，返回 n 张第一条提示词的图片，
+    只有确认服务端支持按提示词批量生成时才应开启
+    """
+    full_prompts = [build_prompt(prompt, style) for prompt in prompts]
+    if not full_prompts:
+        return []
+
+    client = _get_client()
+    if client is not None and len(full_prompts) > 1 and IMAGE_CONFIG.get("batch_api") is True:
+        try:
+            resp = await asyncio.to_thread(
+                client.images.generate,
+                model=KOLORS_MODEL,
+                prompt=full_prompts[0],
+                size=size,
+                n=len(full_prompts),
+                extra_body={"prompts": full_prompts}
+            )
+            urls = [item.url for item in resp.data]
+            if len(urls) == len(full_prompts):
+                results = await asyncio.gather(
+                    *[asyncio.to_thread(_download_image, url) for url in urls],
+                    return_exceptions=True
+                )
+                return [path for path in results if path and not isinstance(path, Exception)]
+            print(f"警告: 批量接口返回 {len(urls)} 张图片（期望 {len(full_prompts)} 张），回退到逐条生成")
+        except Exception as e:
+            print(f"警告: 批量生成图片失败，回退到逐条生成: {e}")
+
+    return await generate_images_async(full_prompts, semaphore=semaphore)
+
+
 # ========== 批量配图 ==========
 def create_images_for_sentences(sentences: list[str],
                                 style: str = "艺术风格",
                                 max_imgs: int = 8) -> list[str]:
-    paths = []
-    for sent in sentences[:max_imgs]:
-        prompt = f"{sent}，{style}，高清，8K"
-        img_path = generate_image(prompt)
-        if img_path:  # 只添加成功生成的图片路径
-            paths.append(img_path)
-    return paths
+    prompts = [build_prompt(sent, style) for sent in sentences[:max_imgs]]
+    return asyncio.run(_generate_images_and_close(prompts))
+
+
+async def _generate_images_and_close(prompts: list[str]) -> list[str]:
+    """生成图片后关闭本事件循环的异步客户端，供 asyncio.run 入口使用"""
+    try:
+        return await generate_images_async(prompts)
+    finally:
+        await close_async_clients()
 
 
 # ========== 自测 ==========
@@ -1,16 +1,307 @@
 import os
 import sys
+import json
 import math
+import queue
+import hashlib
+import shutil
+import threading
+import tempfile
+import textwrap
+import itertools
+import subprocess
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from moviepy.editor import ImageClip, AudioFileClip, VideoFileClip, CompositeVideoClip, concatenate_videoclips, TextClip
-from config import OUTPUT_VIDEOS, VIDEO_CONFIG, IMAGE_CONFIG
+from config import OUTPUT_VIDEOS, VIDEO_CONFIG, IMAGE_CONFIG, ensure_dir
+from PIL import Image
+
+
+# 节奏分析结果的磁盘缓存目录，同一音频重复生成时跳过 librosa 分析
+BEAT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "music_slideshow", "beats")
+_FINGERPRINT_CHUNK = 64 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _ffmpeg_exe():
+    """优先使用 moviepy 自带的 imageio-ffmpeg，其次使用系统 PATH 中的 ffmpeg"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg") or "ffmpeg"
+
+
+@functools.lru_cache(maxsize=4)
+def _detect_nvenc(ffmpeg_exe):
+    """检测指定的 ffmpeg 能否使用 h264_nvenc 硬件编码（每个可执行文件只检测一次）"""
+    try:
+        encoders = subprocess.run(
+            [ffmpeg_exe, '-hide_banner', '-encoders'],
+            capture_output=True, text=True, timeout=10
+        ).stdout
+        if 'h264_nvenc' not in encoders:
+            return False
+        # 编码器编译进 ffmpeg 不代表有可用的 GPU，试编码几帧确认
+        probe = subprocess.run(
+            [ffmpeg_exe, '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'color=black:s=256x256:d=0.1',
+             '-c:v', 'h264_nvenc', '-f', 'null', '-'],
+            capture_output=True, timeout=30
+        )
+        return probe.returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def _video_codec_args(ffmpeg_exe=None):
+    """视频编码参数：NVENC 可用时使用 GPU 编码，否则使用 libx264"""
+    if VIDEO_CONFIG.get("hw_encode", True) and _detect_nvenc(ffmpeg_exe or _ffmpeg_exe()):
+        return ['-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq', '-rc', 'vbr', '-cq', '23']
+    # 幻灯片画面大段静止，不需要 medium 预设的深度运动估计；stillimage 针对静态画面优化
+    # 帧内按线程切分编码，前瞻分析另开线程，充分利用多核
+    return ['-c:v', 'libx264', '-preset', 'fast', '-crf', '23', '-tune', 'stillimage',
+            '-x264-params', 'threads=auto:lookahead-threads=2']
+
+
+@functools.lru_cache(maxsize=1)
+def _drawtext_ffmpeg():
+    """
+    查找带 drawtext 滤镜的 ffmpeg（只检测一次）
+    imageio-ffmpeg 自带的静态版本未编译 drawtext，优先使用系统 PATH 中的 ffmpeg；
+    都不支持时返回 None，由 MoviePy TextClip 完成文字叠加
+    """
+    candidates = [shutil.which("ffmpeg"), _ffmpeg_exe()]
+    for ffmpeg_exe in dict.fromkeys(c for c in candidates if c):
+        try:
+            filters = subprocess.run(
+                [ffmpeg_exe, '-hide_banner', '-filters'],
+                capture_output=True, text=True, timeout=10
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if any(line.split()[1:2] == ['drawtext'] for line in filters.splitlines()):
+            return ffmpeg_exe
+    return None
+
+
+@functools.lru_cache(maxsize=128)
+def _render_caption(text, width, fontsize=36, color='white', bg_color='rgba(0,0,0,0.5)'):
+    """
+    渲染字幕 TextClip 并缓存，重复的歌词只调用一次 ImageMagick
+    
+    返回的剪辑只通过 with_* 派生副本使用，缓存中的对象不会被修改
+    """
+    from moviepy.editor import TextClip
+    
+    # 尝试使用中文字体，如果失败则使用默认设置
+    try:
+        # 创建带背景的文字剪辑，更易读
+        return TextClip(
+            text,
+            fontsize=fontsize,
+            color=color,
+            bg_color=bg_color,
+            font='SimHei',
+            size=(width, None),
+            method='caption'
+        )
+    except Exception:
+        return TextClip(
+            text,
+            fontsize=fontsize,
+            color=color,
+            bg_color=bg_color,
+            size=(width, None),
+            method='caption'
+        )
+
+
+def _load_rgb_image(image_path, size=None):
+    """解码图像为 RGB，并在送入编码器前一次性缩放到 size"""
+    with Image.open(image_path) as img:
+        if size is not None:
+            # JPEG 可在解码时直接按 1/2、1/4、1/8 缩小，大图无需完整解码
+            img.draft("RGB", size)
+        img = img.convert("RGB")
+    if size is not None and img.size != size:
+        # reducing_gap 先按整数倍快速缩小，再做 LANCZOS 精确缩放
+        img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    return img
+
+
+def _audio_fingerprint(audio_path):
+    """快速计算音频文件指纹：文件大小、修改时间以及首尾各 64KB 内容，无需读取整个文件"""
+    st = os.stat(audio_path)
+    h = hashlib.blake2b(f"{st.st_size}:{st.st_mtime_ns}".encode(), digest_size=16)
+    with open(audio_path, 'rb') as f:
+        h.update(f.read(_FINGERPRINT_CHUNK))
+        if st.st_size > 2 * _FINGERPRINT_CHUNK:
+            f.seek(-_FINGERPRINT_CHUNK, os.SEEK_END)
+            h.update(f.read(_FINGERPRINT_CHUNK))
+    return h.hexdigest()
+
+
+def _write_beat_cache(cache_file, tempo, duration_per_image):
+    """保存节奏分析结果，写入失败不影响视频生成"""
+    try:
+        ensure_dir(os.path.dirname(cache_file))
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({"tempo": tempo, "duration_per_image": duration_per_image}, f)
+    except OSError as e:
+        print(f"  保存节奏分析缓存失败: {e}")
+
+
+def _progress_step(total):
+    """进度输出间隔：总数已知时约输出 20 次，未知时每 10 项输出一次"""
+    return max(1, total // 20) if total else 10
+
+
+def _load_image(image_path, size=None):
+    """加载单张图像，文件不存在或解码失败时打印原因并返回 None"""
+    # 直接打开文件，不存在时由 FileNotFoundError 判断，省去单独的 stat 调用
+    try:
+        return _load_rgb_image(image_path, size)
+    except FileNotFoundError:
+        print(f"⚠️ 图像文件不存在，跳过: {image_path}")
+        return None
+    except Exception as e:
+        print(f"❌ 加载图像失败 {image_path}: {e}")
+        return None
+
+
+def _prefetch_images(image_paths, size):
+    """
+    用线程池并发解码并缩放图像，按输入顺序产出 (路径, 图像或 None)
+    
+    边读取 image_paths 边提交任务，预取数量不超过线程数，
+    生成器输入时仍能一边生成图像一边编码
+    """
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for image_path in image_paths:
+            pending.append((image_path, executor.submit(_load_image, image_path, size)))
+            if len(pending) >= workers:
+                image_path, future = pending.popleft()
+                yield image_path, future.result()
+        while pending:
+            image_path, future = pending.popleft()
+            yield image_path, future.result()
+
+
+def _produce_frames(images, frames, stop):
+    """
+    生产者线程：按顺序把 (路径, 图像) 转换为 (路径, RGB 原始帧字节) 放入有界队列
+    
+    结束时放入 None；出错时先放入异常对象，由消费者重新抛出；stop 被设置后立即退出
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    try:
+        for image_path, img in images:
+            if img is not None and not put((image_path, img.tobytes())):
+                return
+    except Exception as e:
+        put(e)
+    put(None)
+
+
+def probe_duration(media_path):
+    """
+    读取音视频时长（秒），只解析容器头部；项目内获取时长统一使用此函数
+    依次尝试 PyAV、ffprobe，都不可用时回退到 MoviePy
+    """
+    try:
+        import av
+        with av.open(media_path) as container:
+            if container.duration:
+                return container.duration / av.time_base
+    except Exception:
+        pass
+    
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", media_path],
+            capture_output=True, text=True, timeout=10
+        )
+        return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        from moviepy.editor import AudioFileClip
+        with AudioFileClip(media_path) as audio_clip:
+            return audio_clip.duration
+
+
+def _probe_audio_codec(audio_path):
+    """读取第一条音频流的编码名称（如 aac、mp3），无法获取时返回 None"""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0",
+             "-show_entries", "stream=codec_name", "-of", "csv=p=0", audio_path],
+            capture_output=True, text=True, timeout=10
+        )
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _probe_video(video_path):
+    """
+    读取视频宽度和时长（秒）
+    ffprobe 只解析容器头部，不解码任何帧；不可用时回退到 MoviePy
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=width:format=duration",
+             "-of", "default=noprint_wrappers=1", video_path],
+            capture_output=True, text=True, timeout=10
+        )
+        info = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+        return int(info["width"]), float(info["duration"])
+    except (OSError, KeyError, ValueError, subprocess.SubprocessError):
+        from moviepy.editor import VideoFileClip
+        with VideoFileClip(video_path, audio=False) as video_clip:
+            return video_clip.w, video_clip.duration
+
+
+def _escape_filter_path(path):
+    """转义滤镜参数中的文件路径（Windows 盘符中的冒号需要转义）"""
+    return path.replace('\\', '/').replace(':', '\\:')
+
+
+def _drawtext_filter(text_file, start, end, fontsize=36):
+    """
+    生成一条 drawtext 滤镜：底部居中、半透明黑底白字，仅在 [start, end] 时间段内显示
+    文字从文本文件读取，避免在滤镜字符串中转义标点和换行
+    """
+    fontfile = VIDEO_CONFIG.get("caption_fontfile")
+    font = f"fontfile='{_escape_filter_path(fontfile)}'" if fontfile else "font='SimHei'"
+    return (
+        f"drawtext=textfile='{_escape_filter_path(text_file)}':expansion=none:{font}:"
+        f"fontsize={fontsize}:fontcolor=white:box=1:boxcolor=black@0.5:boxborderw=10:"
+        f"x=(w-text_w)/2:y=h-text_h-20:enable='between(t,{start:.3f},{end:.3f})'"
+    )
+
 
 class VideoCreator:
     def __init__(self):
-        self.output_dir = OUTPUT_VIDEOS
-        os.makedirs(self.output_dir, exist_ok=True)
+        self.output_dir = ensure_dir(OUTPUT_VIDEOS)
+        # 与输入无关的 ffmpeg 参数只构建一次，每次调用只拼接输入和输出
+        self._ffmpeg_prefix = [_ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error']
+        self._video_args = [*_video_codec_args(), '-pix_fmt', 'yuv420p']
+        self._audio_args = ['-c:a', 'aac', '-b:a', '192k']
         
     def create_slideshow(self, image_paths, audio_path, output_filename=None, 
                         duration_per_image=None, transition_duration=1.0, 
@@ -18,17 +309,17 @@ class VideoCreator:
         """
         创建图像幻灯片视频
         
+        图像逐张解码为 RGB 帧并写入 ffmpeg 标准输入，每张图像只写入一帧，
+        由 ffmpeg 按输出帧率复制帧；image_paths 可以是生成器，此时图像一边生成一边编码。
+        
         参数:
-            image_paths: 图像路径列表
+            image_paths: 图像路径列表或可迭代对象
             audio_path: 音频文件路径
             output_filename: 输出视频文件名
             duration_per_image: 每张图像显示时长（秒），设置为"auto"时自动计算
             transition_duration: 转场动画时长（秒）
             target_resolution: 视频目标分辨率，如(1920, 1080)，默认使用第一张图像的分辨率
         """
-        if not image_paths:
-            raise ValueError("没有提供图像路径")
-        
         if not os.path.exists(audio_path):
             raise FileNotFoundError(f"音频文件不存在: {audio_path}")
         
@@ -36,6 +327,12 @@ class VideoCreator:
         if duration_per_image is None:
             duration_per_image = VIDEO_CONFIG["duration_per_image"]
         
+        # 自动计算时长需要预先知道图像数量，此时才将可迭代对象展开为列表
+        if duration_per_image == "auto" and not isinstance(image_paths, (list, tuple)):
+            image_paths = list(image_paths)
+        if isinstance(image_paths, (list, tuple)) and not image_paths:
+            raise ValueError("没有提供图像路径")
+        
         if output_filename is None:
             base_name = os.path.splitext(os.path.basename(audio_path))[0]
             output_filename = f"{base_name}_slideshow.mp4"
@@ -43,114 +340,145 @@ class VideoCreator:
         output_path = os.path.join(self.output_dir, output_filename)
         
         print(f"🎬 开始创建视频幻灯片...")
-        print(f"  图像数量: {len(image_paths)}")
+        if isinstance(image_paths, (list, tuple)):
+            print(f"  图像数量: {len(image_paths)}")
         print(f"  音频文件: {audio_path}")
         print(f"  输出路径: {output_path}")
         
+        fps = VIDEO_CONFIG["fps"]
+        process = None
+        stop = None
+        
         try:
-            # 1. 加载音频文件
-            print("📻 加载音频文件...")
-            audio_clip = AudioFileClip(audio_path)
-            audio_duration = audio_clip.duration
-            
-            # 2. 计算每张图像的显示时长
+            # 1. 计算每张图像的显示时长
             if duration_per_image == "auto":
                 # 自动计算：总音频时长 / 图像数量
+                audio_duration = probe_duration(audio_path)
                 duration_per_image = audio_duration / len(image_paths)
                 print(f"  自动计算每张图像时长: {duration_per_image:.2f}秒")
             
-            # 获取目标分辨率
-            if target_resolution is None:
-                # 尝试从配置中获取，或者默认为None（使用原始图像尺寸）
-                target_resolution = None
+            frames_per_image = max(1, round(duration_per_image * fps))
             
-            # 3. 创建图像剪辑列表
-            print("🖼️ 创建图像剪辑...")
-            image_clips = []
+            # 指定分辨率时每张图像解码后直接缩放；否则由第一张图像确定分辨率（libx264 要求宽高为偶数）
+            size = None
+            if target_resolution:
+                width, height = target_resolution
+                size = (width - width % 2, height - height % 2)
             
-            for i, image_path in enumerate(image_paths):
-                if not os.path.exists(image_path):
-                    print(f"⚠️ 图像文件不存在，跳过: {image_path}")
-                    continue
-                
-                try:
-                    # 创建图像剪辑
-                    img_clip = ImageClip(image_path)
-                    
-                    # 如果指定了目标分辨率，统一调整所有图像尺寸
-                    if target_resolution:
-                        img_clip = img_clip.resized(target_resolution)
-                    
-                    # 设置显示时长
-                    img_clip = img_clip.set_duration(duration_per_image)
-                    
-                    # 添加淡入淡出效果（首尾图像特殊处理）
-                    
-                    
-                    image_clips.append(img_clip)
-                    print(f"  ✅ 已加载图像 {i+1}/{len(image_paths)}: {os.path.basename(image_path)}")
-                    
-                except Exception as e:
-                    print(f"❌ 加载图像失败 {image_path}: {e}")
-                    continue
+            # 2. 解码图像并写入 ffmpeg
+            print("🖼️ 写入图像帧...")
+            loaded = 0
+            # 进度按批输出，图像很多时不逐张打印
+            total = len(image_paths) if isinstance(image_paths, (list, tuple)) else None
+            report_every = _progress_step(total)
+            total_label = f"/{total}" if total else ""
+            image_iter = iter(image_paths)
+            images = []
             
-            if not image_clips:
-                raise ValueError("没有成功加载任何图像")
+            if size is None:
+                # 未指定分辨率时由第一张成功加载的图像确定（libx264 要求宽高为偶数）
+                for image_path in image_iter:
+                    img = _load_image(image_path)
+                    if img is not None:
+                        width, height = img.size
+                        size = (width - width % 2, height - height % 2)
+                        # 奇数宽高只需裁掉最后一行/列像素
+                        if img.size != size:
+                            img = img.crop((0, 0, *size))
+                        images = [(image_path, img)]
+                        break
             
-            # 4. 合并图像剪辑
-            print("🔗 合并图像剪辑...")
-            video_clip = concatenate_videoclips(image_clips, method="compose")
-            
-            # 5. 设置音频
-            print("🎵 设置音频...")
+            # 其余图像在线程池中并发解码和缩放；生产者线程按原顺序转换为原始帧放入有界队列，
+            # 主线程只负责写入 ffmpeg，解码与编码互相重叠
+            frames = queue.Queue(maxsize=8)
+            stop = threading.Event()
+            producer = threading.Thread(
+                target=_produce_frames,
+                args=(itertools.chain(images, _prefetch_images(image_iter, size)), frames, stop),
+                daemon=True
+            )
+            producer.start()
             
-            # 如果视频时长超过音频时长，截断视频
-            if video_clip.duration > audio_duration:
-                print(f"⚠️ 视频时长({video_clip.duration:.2f}s)超过音频时长({audio_duration:.2f}s)，将截断视频")
-                video_clip = video_clip.subclip(0, audio_duration)
+            while (item := frames.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                image_path, frame = item
+                
+                if process is None:
+                    # 图像数量已知时视频总时长有上限，音频只需读取这一段
+                    max_duration = None
+                    if isinstance(image_paths, (list, tuple)):
+                        max_duration = len(image_paths) * frames_per_image / fps
+                    process = self._start_rawvideo_encoder(size, fps, frames_per_image,
+                                                           audio_path, output_path, max_duration)
+                
+                try:
+                    process.stdin.write(frame)
+                except BrokenPipeError:
+                    # ffmpeg 提前退出（参数、音频或输出路径错误），读取它的报错信息
+                    process.wait()
+                    stderr = process.stderr.read().decode('utf-8', errors='ignore')
+                    raise RuntimeError(f"ffmpeg 提前退出: {stderr[-500:]}") from None
+                
+                loaded += 1
+                if loaded % report_every == 0:
+                    print(f"  ✅ 已写入图像 {loaded}{total_label}: {os.path.basename(image_path)}")
             
-            # 如果音频时长超过视频时长，截断音频
-            audio_clip = audio_clip.subclip(0, video_clip.duration)
+            print(f"  ✅ 共写入 {loaded} 张图像")
             
-            # 设置音频到视频
-            video_clip = video_clip.set_audio(audio_clip)
+            if loaded == 0:
+                raise ValueError("没有成功加载任何图像")
             
-            # 6. 写入视频文件
+            # 3. 结束输入，等待编码完成（-shortest 按音视频较短者截断）
             print("💾 写入视频文件...")
-            video_clip.write_videofile(
-                output_path,
-                fps=VIDEO_CONFIG["fps"],
-                codec='libx264',
-                audio_codec='aac'
-            )
-            
-            # 7. 清理资源
-            for clip in [video_clip, audio_clip] + image_clips:
-                try:
-                    clip.close()
-                except Exception:
-                    pass  # 忽略清理过程中的错误
+            _, stderr = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg 编码失败: {stderr.decode('utf-8', errors='ignore')[-500:]}")
             
             print(f"✅ 视频创建成功: {output_path}")
             return output_path
             
         except Exception as e:
             print(f"❌ 视频创建失败: {e}")
-            # 确保清理资源
-            try:
-                audio_clip.close()
-            except:
-                pass
-            
-            # 清理其他可能已创建的资源
-            try:
-                for clip in image_clips:
-                    clip.close()
-            except:
-                pass
-                
+            # 通知生产者线程停止，确保结束 ffmpeg 进程
+            if stop is not None:
+                stop.set()
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
             return None
     
+    def _start_rawvideo_encoder(self, size, fps, frames_per_image, audio_path, output_path,
+                                max_duration=None):
+        """
+        启动从标准输入读取 RGB 原始帧的 ffmpeg 编码进程
+        
+        输入帧率为 fps/frames_per_image（每张图像一帧），输出按 fps 由 ffmpeg 复制帧，
+        Python 侧无需逐帧写入重复数据；max_duration 给出时在音频输入端截断，
+        超出视频时长的音频不再解码
+        """
+        width, height = size
+        # 输入已是 AAC（如 m4a）时直接复制音频流，省去一次解码和编码
+        audio_args = ['-c:a', 'copy'] if _probe_audio_codec(audio_path) == 'aac' else self._audio_args
+        audio_input = ['-i', audio_path]
+        if max_duration:
+            audio_input = ['-t', f'{max_duration:.3f}'] + audio_input
+        cmd = [
+            *self._ffmpeg_prefix,
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+            '-r', f'{fps}/{frames_per_image}',
+            '-i', 'pipe:0',
+            *audio_input,
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-r', str(fps),
+            *self._video_args,
+            *audio_args,
+            '-shortest',
+            output_path
+        ]
+        # 1MB 写缓冲：一帧 RGB 数据可达数 MB，减少 write 系统调用次数
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20)
+    
     def create_slideshow_with_beat(self, image_paths, audio_path, output_filename=None):
         """
         创建根据音乐节奏切换的图像幻灯片
@@ -158,47 +486,64 @@ class VideoCreator:
         尝试使用 librosa 进行音频节奏分析，如果不可用则回退到固定时长
         """
         print("🎵 正在分析音频节奏...")
+        duration_per_image = self._beat_duration_per_image(audio_path)
+        
+        return self.create_slideshow(
+            image_paths, 
+            audio_path, 
+            output_filename,
+            duration_per_image=duration_per_image
+        )
+    
+    def _beat_duration_per_image(self, audio_path):
+        """根据音乐速度计算每张图像的显示时长，分析结果按音频指纹缓存到磁盘"""
+        cache_file = None
+        try:
+            cache_file = os.path.join(BEAT_CACHE_DIR, f"{_audio_fingerprint(audio_path)}.json")
+            with open(cache_file, encoding='utf-8') as f:
+                cached = json.load(f)
+            print(f"  使用缓存的节奏分析结果: {cached['tempo']:.1f} BPM")
+            print(f"  每张图像显示时长: {cached['duration_per_image']:.2f}秒")
+            return cached["duration_per_image"]
+        except (OSError, ValueError, KeyError):
+            pass
         
         try:
             # 尝试导入 librosa 进行节奏分析
             import librosa
-            import numpy as np
             
-            # 加载音频并分析节拍
-            y, sr = librosa.load(audio_path)
-            onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-            tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
-            
-            # 转换节拍时间戳为秒
-            beat_times = librosa.frames_to_time(beats, sr=sr)
+            # 只需要整体速度：以 11025 Hz 单声道读取前 60 秒即可稳定估计，
+            # 无需解码整首歌曲并逐拍跟踪
+            y, sr = librosa.load(audio_path, sr=11025, mono=True, duration=60.0)
+            try:
+                tempo_fn = librosa.feature.rhythm.tempo
+            except AttributeError:
+                # librosa < 0.10
+                tempo_fn = librosa.beat.tempo
+            tempo = float(tempo_fn(y=y, sr=sr)[0])
             
-            # 计算平均节拍间隔作为图像切换时间
-            if len(beat_times) > 1:
-                avg_beat_interval = np.mean(np.diff(beat_times))
+            # 由速度得到平均节拍间隔作为图像切换时间
+            if tempo > 0:
+                avg_beat_interval = 60.0 / tempo
                 # 确保时间合理（不小于1秒，不大于8秒）
                 duration_per_image = max(1.0, min(8.0, avg_beat_interval * 2))  # 每两拍切换一次
                 print(f"  检测到节奏: {tempo:.1f} BPM")
                 print(f"  计算每张图像显示时长: {duration_per_image:.2f}秒")
-            else:
-                # 如果无法检测到足够的节拍，使用默认值
-                duration_per_image = 4.0
-                print("  无法检测到足够的节拍信息，使用默认时长")
+                if cache_file:
+                    _write_beat_cache(cache_file, tempo, duration_per_image)
+                return duration_per_image
+            
+            # 如果无法检测到足够的节拍，使用默认值
+            print("  无法检测到足够的节拍信息，使用默认时长")
                 
         except ImportError:
             # 如果 librosa 不可用，使用固定时长
             print("  librosa 库未安装，使用固定时长")
-            duration_per_image = 4.0
         except Exception as e:
             # 处理其他可能的异常
             print(f"  节奏分析失败: {e}，使用固定时长")
-            duration_per_image = 4.0
         
-        return self.create_slideshow(
-            image_paths, 
-            audio_path, 
-            output_filename,
-            duration_per_image=duration_per_image
-        )
+        return 4.0
     
     def add_text_overlay(self, video_path, text_list, output_filename=None):
         """
@@ -229,93 +574,127 @@ class VideoCreator:
         print(f"  输出路径: {output_path}")
         
         try:
-            # 加载视频
-            video_clip = VideoFileClip(video_path)
-            
-            # 创建文字剪辑列表
-            text_clips = []
+            # 读取视频宽度和时长，只解析文件头
+            video_width, video_duration = _probe_video(video_path)
             
+            # 先确定有效的文字时间段，没有可叠加的文字时不做任何编码
+            spans = []
             for i, text_info in enumerate(text_list):
                 text = text_info.get('text', '')
                 start_time = text_info.get('start_time', 0)
-                duration = text_info.get('duration', video_clip.duration - start_time)
+                duration = text_info.get('duration', video_duration - start_time)
                 
                 # 确保时间范围有效
-                if start_time >= video_clip.duration:
+                if start_time >= video_duration:
                     print(f"⚠️ 文字 {i+1} 的开始时间超出视频时长，跳过")
                     continue
                 
-                duration = min(duration, video_clip.duration - start_time)
+                duration = min(duration, video_duration - start_time)
+                spans.append((text, start_time, start_time + duration))
+            
+            if not spans:
+                print("⚠️ 没有成功添加任何文字")
+                return video_path  # 返回原始视频路径
+            
+            ffmpeg_exe = _drawtext_ffmpeg()
+            if ffmpeg_exe is None:
+                print("  ffmpeg 不支持 drawtext 滤镜，使用 MoviePy 叠加文字")
+                return self._add_text_overlay_moviepy(video_path, spans, output_path)
+            
+            fontsize = 36
+            # drawtext 不会自动换行，按字号估算每行字数（与原先 caption 宽度一致）
+            chars_per_line = max(1, (video_width - 40) // fontsize)
+            
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # 所有文字合成一条 drawtext 滤镜链，一次 ffmpeg 调用完成叠加
+                filters = []
+                text_files = {}
+                report_every = _progress_step(len(spans))
                 
-                # 创建文字剪辑
-                try:
-                    # 尝试使用中文字体，如果失败则使用默认设置
-                    try:
-                        # 创建带背景的文字剪辑，更易读
-                        txt_clip = TextClip(
-                            text,
-                            fontsize=36,
-                            color='white',
-                            bg_color='rgba(0,0,0,0.5)',
-                            font='SimHei',
-                            size=(video_clip.w - 40, None),
-                            method='caption'
-                        )
-                    except:
-                        txt_clip = TextClip(
-                            text,
-                            fontsize=36,
-                            color='white',
-                            bg_color='rgba(0,0,0,0.5)',
-                            size=(video_clip.w - 40, None),
-                            method='caption'
-                        )
+                for i, (text, start_time, end_time) in enumerate(spans):
+                    # 相同文字共用一个文本文件
+                    text_file = text_files.get(text)
+                    if text_file is None:
+                        text_file = os.path.join(tmp_dir, f"caption_{len(text_files)}.txt")
+                        with open(text_file, 'w', encoding='utf-8') as f:
+                            f.write(textwrap.fill(text, chars_per_line))
+                        text_files[text] = text_file
                     
+                    filters.append(_drawtext_filter(text_file, start_time, end_time, fontsize))
+                    if (i + 1) % report_every == 0 or i + 1 == len(spans):
+                        print(f"  ✅ 已添加文字 {i+1}/{len(spans)}")
+                
+                # 写入新视频，音频流直接复制
+                print("💾 写入带文字的视频文件...")
+                cmd = [
+                    ffmpeg_exe, *self._ffmpeg_prefix[1:],
+                    '-i', video_path,
+                    '-vf', ','.join(filters),
+                    *_video_codec_args(ffmpeg_exe), '-pix_fmt', 'yuv420p',
+                    '-c:a', 'copy',
+                    output_path
+                ]
+                result = subprocess.run(cmd, stderr=subprocess.PIPE)
+                if result.returncode != 0:
+                    raise RuntimeError(f"ffmpeg 文字叠加失败: {result.stderr.decode('utf-8', errors='ignore')[-500:]}")
+            
+            print(f"✅ 文字叠加完成: {output_path}")
+            return output_path
+            
+        except Exception as e:
+            print(f"❌ 文字叠加失败: {e}")
+            return None
+
+    def _add_text_overlay_moviepy(self, video_path, spans, output_path):
+        """
+        ffmpeg 缺少 drawtext 时的备用实现：用 MoviePy TextClip 渲染文字并重新编码
+        
+        参数:
+            spans: 已校验的 (文字, 开始时间, 结束时间) 列表
+        """
+        from moviepy.editor import VideoFileClip, CompositeVideoClip
+        
+        video_clip = VideoFileClip(video_path)
+        text_clips = []
+        try:
+            report_every = _progress_step(len(spans))
+            for i, (text, start_time, end_time) in enumerate(spans):
+                # 创建文字剪辑（相同文字复用已渲染的结果）
+                try:
+                    txt_clip = _render_caption(text, video_clip.w - 40)
                     # 设置位置和时长
-                    txt_clip = txt_clip.with_position('bottom').with_start(start_time).with_duration(duration)
-                    
+                    txt_clip = txt_clip.with_position('bottom').with_start(start_time).with_duration(end_time - start_time)
                     text_clips.append(txt_clip)
-                    print(f"  ✅ 已添加文字 {i+1}/{len(text_list)}")
-                    
+                    if (i + 1) % report_every == 0 or i + 1 == len(spans):
+                        print(f"  ✅ 已添加文字 {i+1}/{len(spans)}")
                 except Exception as e:
                     print(f"❌ 添加文字 {i+1} 失败: {e}")
-                    continue
             
-            # 合并视频和文字
-            if text_clips:
-                video_with_text = CompositeVideoClip([video_clip] + text_clips)
-                
-                # 写入新视频
-                print("💾 写入带文字的视频文件...")
-                video_with_text.write_videofile(
-                    output_path,
-                    fps=video_clip.fps,
-                    codec='libx264',
-                    audio_codec='aac'
-                )
-                
-                # 清理资源
-                video_with_text.close()
-            else:
+            if not text_clips:
                 print("⚠️ 没有成功添加任何文字")
-                output_path = video_path  # 返回原始视频路径
+                return video_path  # 返回原始视频路径
             
+            # 合并视频和文字，写入新视频
+            video_with_text = CompositeVideoClip([video_clip] + text_clips)
+            print("💾 写入带文字的视频文件...")
+            codec_args = _video_codec_args()
+            video_with_text.write_videofile(
+                output_path,
+                fps=video_clip.fps,
+                codec=codec_args[1],
+                audio_codec='aac',
+                threads=os.cpu_count(),
+                ffmpeg_params=codec_args[2:]
+            )
+            video_with_text.close()
+            
+            print(f"✅ 文字叠加完成: {output_path}")
+            return output_path
+        finally:
             # 清理资源
             video_clip.close()
             for clip in text_clips:
                 clip.close()
-            
-            print(f"✅ 文字叠加完成: {output_path}")
-            return output_path
-            
-        except Exception as e:
-            print(f"❌ 文字叠加失败: {e}")
-            # 确保清理资源
-            try:
-                video_clip.close()
-            except:
-                pass
-            return None
 
 def test_video_creation():
     """测试视频创建功能"""
@@ -344,12 +723,15 @@ def test_video_creation():
                 print(f"❌ 创建测试图像 {i+1}/5 失败: {e}")
         test_images.append(img_path)
     
-    # 创建测试音频（一段静音）
-    from pydub import AudioSegment
+    # 创建测试音频（10秒静音），由 ffmpeg 的 anullsrc 直接生成
     test_audio_path = os.path.join(test_image_dir, "test_audio.wav")
     if not os.path.exists(test_audio_path):
-        silence = AudioSegment.silent(duration=10000)  # 10秒静音
-        silence.export(test_audio_path, format="wav")
+        subprocess.run(
+            [_ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=stereo', '-t', '10',
+             '-c:a', 'pcm_s16le', test_audio_path],
+            check=True
+        )
     
     # 创建视频
     creator = VideoCreator()